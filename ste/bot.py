@@ -1,71 +1,414 @@
 # asyncio - встроенная библиотека Python для асинхронного программирования
 import asyncio
 import os
+import sys
+# html.escape() - экранирует текст задач в напоминаниях (разметка HTML)
+import html
+# hmac - встроенная библиотека; compare_digest() сверяет секрет webhook
+import hmac
+# socket - встроенная библиотека; gethostname() даёт имя машины для идентификатора процесса
+import socket
+# re - встроенная библиотека регулярных выражений; проверяет курсор страницы из данных кнопки
+import re
+# heapq - встроенная библиотека Python для работы с кучей (очередью с приоритетом)
+# Используется планировщиком напоминаний: ближайшее напоминание всегда на вершине кучи
+import heapq
+# time - встроенная библиотека; monotonic() используется для подсчёта скорости отправки
+import time
+# datetime - встроенная библиотека для работы с датой и временем
+from datetime import datetime, timedelta
+# OrderedDict - словарь, помнящий порядок; namedtuple - лёгкая запись вместо объекта модели
+# deque - очередь последних задержек доставки; Counter - число ошибок по классам
+from collections import Counter, OrderedDict, deque, namedtuple
 # aiogram.Dispatcher - диспетчер событий из библиотеки aiogram для Telegram ботов
-from aiogram import Dispatcher
+from aiogram import Dispatcher, F  # F - фильтр по полям события (данные нажатой кнопки)
+# BaseMiddleware - обёртка вокруг обработчиков aiogram (замер времени команд)
+from aiogram import BaseMiddleware
 # aiogram.filters - модуль фильтров для обработки команд и сообщений
 # Command - фильтр для команд типа /start, /login
 # Без этого: не работает парсинг аргументов
 from aiogram.filters import Command, CommandObject
+# TelegramRetryAfter - исключение aiogram, когда Telegram просит подождать перед следующей отправкой
+# TelegramForbiddenError - бот заблокирован пользователем; TelegramBadRequest - например, чат не найден
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+# Update - обновление Telegram; в режиме webhook разбираем его из тела запроса сами
+# InlineKeyboardMarkup, InlineKeyboardButton - кнопки листания длинных списков задач под сообщением
+from aiogram.types import Update, InlineKeyboardMarkup, InlineKeyboardButton
 # asgiref.sync.sync_to_async - адаптер для вызова синхронного кода из асинхронного
 # Позволяет использовать Django ORM (синхронный) в асинхронных функциях бота
 # Без этого: невозможна работа с базой данных Django из асинхронного кода
 from asgiref.sync import sync_to_async
+# ThreadPoolExecutor - пул потоков, в которых бот параллельно ходит в базу
+import functools
+from concurrent.futures import ThreadPoolExecutor
 # Конфигурация Django для запуска ORM вне веб-приложения
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ste.settings')
 import django  # Основной модуль Django фреймворка
 django.setup()  # Инициализация Django приложения
 # TelegramProfile - модель связи пользователей с Telegram
-from stem.models import Task, TelegramProfile
+# sweep_overdue_tasks - фоновая пометка просроченных задач всех пользователей
+# NotificationOutbox - попытки и ошибки доставки напоминаний
+from stem.models import NotificationOutbox, Task, TelegramProfile, sweep_overdue_tasks
 # django.contrib.auth.models.User - встроенная модель пользователей Django
 from django.contrib.auth.models import User
 from ste.settings import BOT
 # django.utils.timezone - модуль работы с временными зонами Django
 from django.utils import timezone
+# transaction - транзакции Django; Q - объединение условий фильтра через ИЛИ
+# close_old_connections - возвращает соединение потока в пул после запроса
+from django.db import IntegrityError, transaction, close_old_connections
+from django.db.models import Q
+# DbF - ссылка на колонку в UPDATE (имя F уже занято фильтром aiogram)
+from django.db.models import F as DbF
+# Greatest - наибольшее из значений (в PostgreSQL NULL пропускается): время напоминания или следующей попытки
+# Now - текущее время на стороне базы (время отметки доставки)
+from django.db.models.functions import Greatest, Now
+# django.conf.settings - настройки проекта (параметры подключения к БД для LISTEN)
+from django.conf import settings
+# REMINDER_CHANNEL - канал PostgreSQL, в который сайт сообщает об изменениях напоминаний
+# CHAT_CHANNEL - канал, в который сайт и другие процессы бота сообщают об изменении привязки чата
+# TASKS_CHANNEL - канал, в который сообщается об изменении задач пользователей
+from stem.signals import REMINDER_CHANNEL, CHAT_CHANNEL, TASKS_CHANNEL, notify_chat_changed, notify_reminder_changed
+# Кэш готовых ответов со списками задач
+from stem.cache import LOCAL_CACHE, bump_tasks_version, clear_local_replies, get_cached_reply
+# Метрики: время обработчиков и их запросы к базе
+from stem.metrics import REGISTRY, RequestTimer
 
-# Функция для проверки авторизации пользователя по chat_id
-@sync_to_async  # декоратор - преобразует синхронную функцию в асинхронную
-def get_user_by_chat_id(chat_id):
-    """Получает пользователя Django по Telegram chat_id"""
-    try:
-        return TelegramProfile.objects.get(telegram_chat_id=chat_id).user  # objects.get() - метод получения одного объекта из БД
-    except TelegramProfile.DoesNotExist:  # DoesNotExist - исключение когда объект не найден в БД
+# Идентификатор этого процесса бота для аренды напоминаний ("хост:pid")
+WORKER_ID = socket.gethostname() + ":" + str(os.getpid())
+# Срок аренды: если процесс упал, его напоминания заберут другие процессы через 5 минут
+CLAIM_LEASE = timedelta(minutes=5)
+# Пока пачка отправляется, аренда её недоставленных напоминаний продлевается с таким интервалом
+# Без этого: пачка, которая отправляется дольше аренды (сотни напоминаний одного чата, паузы RetryAfter),
+# забиралась бы другим процессом и отправлялась повторно
+CLAIM_RENEW_INTERVAL = CLAIM_LEASE / 3
+# Сколько напоминаний процесс забирает за один раз
+CLAIM_BATCH_SIZE = 500
+# По сколько строк забранной пачки читать из курсора базы за один раз
+REMINDER_FETCH_CHUNK = 100
+
+# Повторы неудачных доставок: пауза растёт вдвое после каждой ошибки (1, 2, 4 ... минут, но не больше часа)
+# После OUTBOX_MAX_ATTEMPTS ошибок напоминание больше не отправляется
+# Без этого: недоставляемые напоминания забирались бы снова при каждой проверке и тратили лимит Telegram
+OUTBOX_RETRY_BASE = timedelta(minutes=1)
+OUTBOX_RETRY_MAX = timedelta(hours=1)
+OUTBOX_MAX_ATTEMPTS = 8
+
+# Напоминания одного чата, время которых отличается не больше чем на это окно, уходят одним сообщением-дайджестом
+# Окно задаётся в settings.REMINDER_DIGEST_WINDOW (секунды); 0 - каждое напоминание отдельным сообщением
+REMINDER_DIGEST_WINDOW = timedelta(seconds=settings.REMINDER_DIGEST_WINDOW)
+# Напоминания и дайджесты размечены HTML: название и описание задачи экранируются html.escape()
+# Без этого: символ разметки в названии (например "config_file") ломал разбор всего дайджеста,
+# и Telegram отклонял сообщение со всеми его напоминаниями при каждой попытке
+REMINDER_PARSE_MODE = 'HTML'
+DIGEST_HEADER = "⏰ <b>НАПОМИНАНИЯ!</b>\n\n"
+DIGEST_FOOTER = "💡 Команда <code>/tasksTime</code> покажет все напоминания"
+
+# Сколько последних задержек доставки хранить для процентилей в статистике процесса
+DELIVERY_LAG_SAMPLES = 10000
+
+# Горизонт планировщика: в память загружаются только напоминания на ближайшие 10 минут
+# Без этого: при сотнях тысяч напоминаний куча занимала бы слишком много памяти
+SCHEDULER_HORIZON = timedelta(minutes=10)
+
+# Лимиты Telegram: около 30 сообщений в секунду на бота и 1 сообщение в секунду в один чат
+GLOBAL_RATE_LIMIT = 30
+CHAT_RATE_LIMIT = 1
+# Сколько напоминаний отправляется одновременно
+SEND_CONCURRENCY = 20
+# Сколько раз повторяем отправку после ответа RetryAfter
+MAX_RETRY_AFTER = 5
+# Доставленные напоминания помечаются пачками по 500 id, но не реже раза в 2 секунды
+MARK_SENT_BATCH_SIZE = 500
+MARK_SENT_FLUSH_INTERVAL = 2
+
+# Как часто бот помечает просроченные задачи (в секундах)
+OVERDUE_SWEEP_INTERVAL = 60
+
+# Сколько запросов бота к базе выполняются одновременно (по соединению из пула на каждый)
+# Пул соединений задан в settings.DATABASES['default']['OPTIONS']['pool']
+DB_THREADS = 10
+
+# Кэш "чат -> пользователь": до 10000 чатов, каждая запись живёт 5 минут
+# Срок жизни страхует от пропущенного сброса (например, если бот был отключён от LISTEN)
+CHAT_CACHE_SIZE = 10000
+CHAT_CACHE_TTL = 300
+# Раз в сколько обращений печатать статистику кэша
+CHAT_CACHE_REPORT_EVERY = 1000
+
+# Пользователь чата в кэше: только то, что нужно обработчикам команд
+# Без этого: в кэше лежали бы объекты модели, привязанные к соединению с базой
+ChatUser = namedtuple('ChatUser', ['id', 'username'])
+
+# Напоминание к отправке: только поля, которые нужны send_notification
+# Без этого: в памяти лежали бы все колонки задачи, пользователя и профиля Telegram
+ReminderRecord = namedtuple('ReminderRecord', [
+    'id', 'title', 'description', 'created_at', 'reminder_time', 'username', 'chat_id'
+])
+
+# Одно сообщение Telegram с напоминаниями: чат, текст и записи ReminderRecord, которые в нём отправляются
+ReminderMessage = namedtuple('ReminderMessage', ['chat_id', 'text', 'tasks'])
+
+# Потоки для запросов к базе
+# sync_to_async по умолчанию (thread_sensitive=True) выполняет весь ORM в одном потоке по очереди,
+# и асинхронные методы Django (aget, aupdate, async for) в Django 5 устроены так же
+# Без этого: одна медленная команда /taskAll задерживала ответы всем остальным чатам
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix='bot-db')
+
+# Декоратор функций бота, работающих с базой
+def db_async(func):
+    """Превращает синхронную функцию ORM в асинхронную, выполняемую в одном из DB_THREADS потоков"""
+    def run_in_db_thread(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            # У каждого потока своё соединение Django; после запроса отдаём его обратно в пул
+            # Без этого: потоки держали бы соединения вечно и не замечали обрыва связи с базой
+            close_old_connections()
+
+    @functools.wraps(func)  # wraps() - сохраняет имя и описание исходной функции
+    async def wrapper(*args, **kwargs):
+        # DB_EXECUTOR берётся при вызове: нагрузочный тест (bot_loadtest) подменяет его для сравнения
+        return await sync_to_async(run_in_db_thread, thread_sensitive=False, executor=DB_EXECUTOR)(*args, **kwargs)
+    return wrapper
+
+# Кэш пользователей чатов в памяти процесса бота (LRU + срок жизни)
+class ChatUserCache:
+    """Помнит, какой пользователь привязан к чату, чтобы не ходить в базу на каждое сообщение"""
+
+    def __init__(self, maxsize=CHAT_CACHE_SIZE, ttl=CHAT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # chat_id -> (пользователь или None, момент устаревания)
+        self.generation = 0  # растёт при каждом сбросе; защищает от записи устаревшего ответа базы
+        self.pending = {}  # chat_id -> запрос к базе, который уже выполняется для этого чата
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chat_id):
+        """Возвращает (найдено ли в кэше, пользователь или None для неавторизованного чата)"""
+        entry = self.entries.get(chat_id)
+        if entry is not None and entry[1] > time.monotonic():
+            self.entries.move_to_end(chat_id)  # move_to_end() - чат недавно использовался
+            self.hits += 1
+            self.report()
+            return True, entry[0]
+        if entry is not None:
+            del self.entries[chat_id]  # срок жизни истёк
+        self.misses += 1
+        self.report()
+        return False, None
+
+    def put(self, chat_id, user, generation=None):
+        """Запоминает пользователя чата; generation - номер поколения на момент запроса к базе"""
+        # Пока шёл запрос к базе, привязку могли изменить - такой ответ не запоминаем
+        if generation is not None and generation != self.generation:
+            return
+        self.entries[chat_id] = (user, time.monotonic() + self.ttl)
+        self.entries.move_to_end(chat_id)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)  # popitem(last=False) - вытесняем давно не использованный чат
+
+    def invalidate(self, chat_id):
+        """Забывает пользователя чата после изменения привязки"""
+        self.generation += 1
+        self.entries.pop(chat_id, None)
+        self.pending.pop(chat_id, None)  # новые сообщения не должны ждать запрос, начатый до изменения
+
+    def clear(self):
+        """Забывает все чаты (сбросы могли быть пропущены, пока не было соединения LISTEN)"""
+        self.generation += 1
+        self.entries.clear()
+        self.pending.clear()
+
+    def report(self):
+        """Печатает долю попаданий раз в CHAT_CACHE_REPORT_EVERY обращений"""
+        lookups = self.hits + self.misses
+        if lookups % CHAT_CACHE_REPORT_EVERY == 0:
+            print("🗂 Кэш чатов: попаданий " + str(self.hits) + ", промахов " + str(self.misses)
+                  + " (" + str(round(self.hits * 100 / lookups)) + "%), записей " + str(len(self.entries)))
+
+# Общий кэш пользователей чатов процесса бота
+CHAT_USERS = ChatUserCache()
+
+# Функция загрузки пользователя чата из базы
+@db_async  # декоратор - преобразует синхронную функцию в асинхронную
+def load_user_by_chat_id(chat_id):
+    """Получает id и имя пользователя Django по Telegram chat_id одним запросом"""
+    # values_list() - берём только два поля вместо профиля и пользователя целиком
+    row = TelegramProfile.objects.filter(telegram_chat_id=chat_id).values_list('user_id', 'user__username').first()
+    if row is None:
         return None
+    return ChatUser(*row)
+
+# Функция для проверки авторизации пользователя по chat_id
+async def get_user_by_chat_id(chat_id):
+    """Получает пользователя по Telegram chat_id: сначала из кэша, при промахе из базы"""
+    found, user = CHAT_USERS.get(chat_id)
+    if found:
+        return user
+
+    # Несколько сообщений одного чата, пришедшие одновременно, ждут один и тот же запрос к базе
+    # Без этого: пачка из 20 сообщений одного чата давала 20 одинаковых запросов
+    pending = CHAT_USERS.pending.get(chat_id)
+    if pending is None:
+        pending = asyncio.ensure_future(load_and_cache_user(chat_id))  # ensure_future() - запускаем запрос как задачу
+        CHAT_USERS.pending[chat_id] = pending
+
+        def forget_pending(future):
+            if CHAT_USERS.pending.get(chat_id) is future:
+                del CHAT_USERS.pending[chat_id]
+        pending.add_done_callback(forget_pending)
+    # shield() - отмена одного обработчика не отменяет запрос, который ждут остальные
+    return await asyncio.shield(pending)
+
+# Функция загрузки пользователя чата с записью в кэш
+async def load_and_cache_user(chat_id):
+    """Загружает пользователя чата из базы и запоминает его в кэше"""
+    generation = CHAT_USERS.generation
+    user = await load_user_by_chat_id(chat_id)
+    # Неавторизованные чаты тоже запоминаем: иначе каждое их сообщение шло бы в базу
+    CHAT_USERS.put(chat_id, user, generation)
+    return user
 
 # Функция для авторизации пользователя по уникальному 10-значному ID
-@sync_to_async
-def authorize_user(unique_id, chat_id):  # unique_id - переменная с 10-значным ID для авторизации
+@db_async
+def save_chat_binding(unique_id, chat_id):  # unique_id - переменная с 10-значным ID для авторизации
     """Связывает Telegram chat_id с профилем пользователя через unique_id"""
     try:
-        profile = TelegramProfile.objects.get(unique_id=unique_id)  # получаем профиль по уникальному ID
-        profile.telegram_chat_id = chat_id  # chat_id - переменная с ID чата в Telegram
-        profile.save()  # save() - метод сохранения изменений в БД
-        return profile.user
+        profile = TelegramProfile.objects.select_related('user').get(unique_id=unique_id)  # получаем профиль по уникальному ID
+        old_chat_id = profile.telegram_chat_id
+        user = ChatUser(profile.user.id, profile.user.username)
+        if old_chat_id == chat_id:
+            return user, old_chat_id  # чат уже привязан к этому профилю - писать в базу нечего
+        with transaction.atomic():
+            # Чат может быть привязан только к одному профилю (profile_unique_chat_id) - отвязываем прежний
+            TelegramProfile.objects.filter(telegram_chat_id=chat_id).exclude(id=profile.id).update(telegram_chat_id=None)
+            # UPDATE одного поля вместо save(), который переписал бы всю строку профиля
+            TelegramProfile.objects.filter(id=profile.id).update(telegram_chat_id=chat_id)  # chat_id - переменная с ID чата в Telegram
+        notify_chat_changed(chat_id)  # другие процессы бота сбрасывают этот чат из кэша
+        if old_chat_id:
+            notify_chat_changed(old_chat_id)  # профиль перенесён из другого чата
+        return user, old_chat_id
     except TelegramProfile.DoesNotExist:  # исключение - профиль с таким ID не найден
-        return None
+        return None, None
+
+async def authorize_user(unique_id, chat_id):
+    """Авторизует чат и сразу сбрасывает его из кэша этого процесса"""
+    user, old_chat_id = await save_chat_binding(unique_id, chat_id)
+    if user:
+        CHAT_USERS.invalidate(chat_id)
+        if old_chat_id:
+            CHAT_USERS.invalidate(old_chat_id)
+    return user
 
 # Функция для отвязки Telegram бота от профиля пользователя
-@sync_to_async
-def disconnect_user(chat_id):
+@db_async
+def clear_chat_binding(chat_id):
     """Отвязывает Telegram chat_id от профиля пользователя (устанавливает None)"""
-    try:
-        profile = TelegramProfile.objects.get(telegram_chat_id=chat_id)
-        user = profile.user
-        profile.telegram_chat_id = None  # Отвязываем chat_id
-        profile.save()
-        return user
-    except TelegramProfile.DoesNotExist:
+    # Кому привязан чат - только id и имя пользователя, без загрузки профиля целиком
+    row = TelegramProfile.objects.filter(telegram_chat_id=chat_id).values_list('id', 'user_id', 'user__username').first()
+    if row is None:
         return None
+    # Условный UPDATE: отвязываем, только если чат всё ещё привязан к этому профилю
+    # 0 строк - чат успели отвязать или перепривязать (например, с сайта) - отключать нечего
+    if not TelegramProfile.objects.filter(id=row[0], telegram_chat_id=chat_id).update(telegram_chat_id=None):
+        return None
+    notify_chat_changed(chat_id)  # другие процессы бота сбрасывают этот чат из кэша
+    return ChatUser(row[1], row[2])
+
+async def disconnect_user(chat_id):
+    """Отвязывает чат и сразу сбрасывает его из кэша этого процесса"""
+    user = await clear_chat_binding(chat_id)
+    CHAT_USERS.invalidate(chat_id)
+    return user
+
+# === СООБЩЕНИЯ СО СПИСКАМИ ЗАДАЧ ===
+# Telegram не принимает сообщения длиннее 4096 символов (считаются в UTF-16)
+MESSAGE_LIMIT = 4096
+# Описание задачи в боте обрезается, чтобы одна задача всегда помещалась в сообщение
+DESCRIPTION_PREVIEW = 300
+# Сколько задач читать из базы за раз, пока собирается одна страница
+TASKS_FETCH_CHUNK = 50
+
+# Длина текста так, как её считает Telegram (эмодзи занимают 2 единицы UTF-16)
+def telegram_length(text):
+    return len(text.encode('utf-16-le')) // 2
+
+# Сборщик одного сообщения из блоков (по блоку на задачу)
+class MessageBuilder:
+    """Складывает блоки в сообщение, пока оно помещается в лимит Telegram"""
+
+    def __init__(self, header, footer="", limit=MESSAGE_LIMIT):
+        self.parts = [header]  # части сообщения склеиваются один раз в text(); без этого += копировал бы всё сообщение
+        self.footer = footer
+        self.length = telegram_length(header) + telegram_length(footer)
+        self.limit = limit
+        self.blocks = 0
+
+    def add(self, block):
+        """Добавляет блок; False - блок не поместился, сообщение заполнено"""
+        block_length = telegram_length(block)
+        if self.length + block_length > self.limit:
+            return False
+        self.parts.append(block)
+        self.length += block_length
+        self.blocks += 1
+        return True
+
+    def text(self):
+        return "".join(self.parts) + self.footer
+
+# Функция сокращения описания задачи
+def short_description(description):
+    """Обрезает длинное описание до DESCRIPTION_PREVIEW символов"""
+    if len(description) > DESCRIPTION_PREVIEW:
+        return description[:DESCRIPTION_PREVIEW] + "…"
+    return description
+
+# Клавиатура листания списка задач под сообщением
+def tasks_keyboard(kind, cursor, next_cursor):
+    """Кнопки "Дальше" (если задачи не поместились) и "В начало" (если это не первая страница)"""
+    buttons = []
+    if cursor:
+        buttons.append(InlineKeyboardButton(text="⏮ В начало", callback_data="tasks:" + kind + ":"))
+    if next_cursor:
+        # callback_data - до 64 байт: тип списка и курсор последней показанной задачи
+        buttons.append(InlineKeyboardButton(text="Дальше ▶️", callback_data="tasks:" + kind + ":" + next_cursor))
+    if not buttons:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[buttons])
+
+# Формат курсора страницы: id задачи для /notes и /reminders, "раздел.id" для /taskAll (раздел 0-2)
+TASKS_CURSOR_FORMATS = {
+    "notes": re.compile(r"\d{1,18}"),
+    "reminders": re.compile(r"\d{1,18}"),
+    "all": re.compile(r"[0-2]\.\d{1,18}"),
+}
+
+# Функция проверки курсора из данных кнопки
+def valid_tasks_cursor(kind, cursor):
+    """Возвращает курсор, если он в формате списка kind, иначе None (первая страница)"""
+    # Данные кнопки присылает клиент - подделанный курсор не должен ронять обработчик
+    if cursor and TASKS_CURSOR_FORMATS[kind].fullmatch(cursor):
+        return cursor
+    return None
 
 # Универсальная функция для получения задач с различными фильтрами
-@sync_to_async
-def get_user_tasks_filtered(user, task_type="all"):  # task_type="all" - параметр по умолчанию для типа задач
-    """Универсальная функция для получения задач с фильтрацией по типу"""
+@db_async
+def get_user_tasks_filtered(user, task_type="all", cursor=None):  # cursor - id последней задачи предыдущей страницы
+    """Возвращает (текст страницы задач, курсор следующей страницы или None)"""
     if not user:
-        return "❌ Авторизуйтесь командой `/login ВАШ_ID`"
-    
+        return "❌ Авторизуйтесь командой `/login ВАШ_ID`", None
+    # Пока задачи пользователя не менялись, отвечаем сохранённым текстом без запросов к задачам
+    return get_cached_reply(user.id, task_type + ":" + (cursor or ""),
+                            lambda: build_tasks_page(user.id, task_type, cursor))
+
+# Функция сборки страницы заметок или напоминаний
+def build_tasks_page(user_id, task_type, cursor=None):
+    """Возвращает (текст страницы задач, курсор следующей страницы или None)"""
     # Определяем фильтр и заголовок в зависимости от типа
-    filters = {'user': user, 'completed': False}  # filters - словарь с параметрами фильтрации
+    filters = {'user_id': user_id, 'completed': False}  # filters - словарь с параметрами фильтрации
     
     if task_type == "notes":  # task_type - переменная определяющая тип задач
         filters['reminder_time__isnull'] = True  # reminder_time__isnull - фильтр Django для NULL значений
@@ -76,17 +419,24 @@ def get_user_tasks_filtered(user, task_type="all"):  # task_type="all" - пар
         title = "⏰ *Ваши напоминания:*"
         empty_msg = "⏰ *Напоминания:*\n\nУ вас нет активных напоминаний."
     
-    tasks = Task.objects.filter(**filters)  # Task.objects.filter(**filters) - метод фильтрации задач по параметрам
-    if not tasks:
-        return empty_msg
-    
-    result = title + "\n\n"
-    for task in tasks:
+    # Новые задачи сначала; следующая страница начинается после последней показанной задачи
+    tasks = Task.objects.filter(**filters).order_by('-id')  # Task.objects.filter(**filters) - метод фильтрации задач по параметрам
+    if cursor:
+        tasks = tasks.filter(id__lt=int(cursor))
+        title += " _(продолжение)_"
+    tasks = tasks.values_list('id', 'title', 'description', 'created_at', 'reminder_time', 'overdue', named=True)
+
+    builder = MessageBuilder(title + "\n\n")
+    next_cursor = None
+    last_id = None
+    # iterator() - задачи читаются из базы порциями, пока страница не заполнится; остальные не загружаются
+    for task in tasks.iterator(chunk_size=TASKS_FETCH_CHUNK):
+        lines = []
         if task_type == "notes":
-            result += "📝 *" + task.title + "*\n"
+            lines.append("📝 *" + task.title + "*\n")
             if task.description:  # description - поле модели с описанием задачи
-                result += "_" + task.description + "_\n"
-            result += "📅 Создано: " + task.created_at.strftime('%d.%m.%Y %H:%M') + "\n\n"
+                lines.append("_" + short_description(task.description) + "_\n")
+            lines.append("📅 Создано: " + task.created_at.strftime('%d.%m.%Y %H:%M') + "\n\n")
         elif task_type == "reminders":
             # Определяем иконку в зависимости от статуса
             if task.overdue:
@@ -96,171 +446,827 @@ def get_user_tasks_filtered(user, task_type="all"):  # task_type="all" - пар
                 icon = "⏰"
                 status = "Активно"
             
-            result += icon + " *" + task.title + "*\n"
+            lines.append(icon + " *" + task.title + "*\n")
             if task.description:  # проверка наличия описания задачи
-                result += "_" + task.description + "_\n"
-            result += "📅 Создано: " + task.created_at.strftime('%d.%m.%Y %H:%M') + "\n"
-            result += "⏰ Напоминание: " + task.reminder_time.strftime('%d.%m.%Y %H:%M') + "\n"
-            result += "Статус: " + status + "\n\n"
-    
-    return result
+                lines.append("_" + short_description(task.description) + "_\n")
+            lines.append("📅 Создано: " + task.created_at.strftime('%d.%m.%Y %H:%M') + "\n")
+            lines.append("⏰ Напоминание: " + task.reminder_time.strftime('%d.%m.%Y %H:%M') + "\n")
+            lines.append("Статус: " + status + "\n\n")
+
+        if not builder.add("".join(lines)):
+            next_cursor = str(last_id)  # задача не поместилась - с неё начнётся следующая страница
+            break
+        last_id = task.id
+
+    if not builder.blocks:
+        return empty_msg, None
+    return builder.text(), next_cursor
+
+# Разделы списка /taskAll в порядке вывода: номер раздела, заголовок, иконка задачи
+TASK_ALL_SECTIONS = {
+    0: "🟢 *АКТИВНЫЕ:*\n",
+    1: "🔴 *ПРОСРОЧЕННЫЕ:*\n",
+    2: "✅ *ЗАВЕРШЕННЫЕ:*\n",
+}
+
+# Функция сборки страницы /taskAll
+def build_all_tasks_page(user_id, cursor=None):  # cursor - "раздел.id" последней задачи предыдущей страницы
+    """Возвращает (страницу всех задач по разделам, курсор следующей страницы или None) за один запрос"""
+    # Один запрос: только нужные колонки всех задач, новые сначала
+    # Без этого: отдельные запросы на счётчики и на каждый раздел
+    rows = Task.objects.filter(user_id=user_id).order_by('-id').values_list(
+        'id', 'title', 'reminder_time', 'completed', 'overdue'
+    )
+
+    # Раскладываем задачи по разделам за один проход: 0 - активные, 1 - просроченные, 2 - завершённые
+    sections = ([], [], [])
+    for task_id, title, reminder_time, completed, overdue in rows:
+        if completed:
+            sections[2].append((task_id, "✅ " + title))
+        elif overdue:
+            sections[1].append((task_id, "❗️ " + title))
+        elif reminder_time:
+            sections[0].append((task_id, "⏰ " + title))
+        else:
+            sections[0].append((task_id, "📝 " + title))
+
+    # Счётчики - это размеры разделов, отдельный COUNT не нужен
+    active_count = len(sections[0])
+    overdue_count = len(sections[1])
+    completed_count = len(sections[2])
+    total_count = active_count + overdue_count + completed_count
+    if not total_count:
+        return "📋 *Все задачи:*\n\nУ вас пока нет задач.", None
+
+    header = "📋 *Все ваши задачи:*\n\n"
+    start_section = 0
+    start_id = None
+    if cursor:
+        start_section, start_id = [int(part) for part in cursor.split(".")]
+        header = "📋 *Все ваши задачи* _(продолжение)_:\n\n"
+
+    # Добавляем статистику
+    footer = ("📊 *Статистика:* Всего: " + str(total_count) + " | Активных: " + str(active_count)
+              + " | Просроченных: " + str(overdue_count) + " | Завершенных: " + str(completed_count))
+
+    builder = MessageBuilder(header, footer)
+    last_shown = None  # (раздел, id) последней задачи на странице
+    for section in range(start_section, len(sections)):
+        section_started = False
+        for task_id, line in sections[section]:
+            # Задачи до курсора уже были на предыдущих страницах
+            if section == start_section and start_id is not None and task_id >= start_id:
+                continue
+            block = line + "\n"
+            # Заголовок раздела выводится вместе с первой задачей раздела на странице
+            if not section_started:
+                block = TASK_ALL_SECTIONS[section] + block
+                if last_shown is not None:
+                    block = "\n" + block
+            if not builder.add(block):
+                return builder.text(), str(last_shown[0]) + "." + str(last_shown[1])
+            section_started = True
+            last_shown = (section, task_id)
+    builder.add("\n")
+    return builder.text(), None
 
 # Функция для получения всех задач пользователя с разделением по категориям
-@sync_to_async
-def get_all_tasks(user):
+@db_async
+def get_all_tasks(user, cursor=None):
     """Возвращает все задачи пользователя, разделенные на активные, просроченные и завершенные"""
     if not user:
-        return "❌ Авторизуйтесь командой `/login ВАШ_ID`"
-    
-    all_tasks = Task.objects.filter(user=user)
-    if not all_tasks:
-        return "📋 *Все задачи:*\n\nУ вас пока нет задач."
-    
-    # Разделяем задачи по категориям для удобного отображения
-    active = all_tasks.filter(completed=False, overdue=False)
-    overdue = all_tasks.filter(overdue=True, completed=False)
-    completed = all_tasks.filter(completed=True)
-    
-    result = "📋 *Все ваши задачи:*\n\n"
-    
-    # Отображаем активные задачи
-    if active:
-        result += "🟢 *АКТИВНЫЕ:*\n"
-        # Проходим по каждой активной задаче
-        for task in active:
-            if task.reminder_time:
-                task_icon = "⏰"
-            else:
-                task_icon = "📝"
-            result += task_icon + " " + task.title + "\n"
-        result += "\n"
-    
-    # Отображаем просроченные задачи
-    if overdue:
-        result += "🔴 *ПРОСРОЧЕННЫЕ:*\n"
-        for task in overdue:
-            result += "❗️ " + task.title + "\n"
-        result += "\n"
-    
-    # Отображаем завершенные задачи
-    if completed:
-        result += "✅ *ЗАВЕРШЕННЫЕ:*\n"
-        for task in completed:
-            result += "✅ " + task.title + "\n"
-        result += "\n"
-    
-    # Добавляем статистику
-    total_count = str(all_tasks.count())
-    active_count = str(active.count())
-    overdue_count = str(overdue.count())
-    completed_count = str(completed.count())
-    result += "📊 *Статистика:* Всего: " + total_count + " | Активных: " + active_count + " | Просроченных: " + overdue_count + " | Завершенных: " + completed_count
-    return result
-
-# Функция для проверки и отправки напоминаний
-@sync_to_async
-def get_pending_notifications():
-    """Получает список напоминаний, которые нужно отправить"""
+        return "❌ Авторизуйтесь командой `/login ВАШ_ID`", None
+    return get_cached_reply(user.id, "all:" + (cursor or ""), lambda: build_all_tasks_page(user.id, cursor))
+
+# Функция для захвата напоминаний на отправку
+@db_async
+def claim_pending_notifications(limit=CLAIM_BATCH_SIZE):
+    """Забирает в аренду этому процессу пачку напоминаний, время которых наступило"""
     # Django уже настроен на московское время в settings.py
     now = timezone.now()
     
-    # Ищем напоминания, время которых уже наступило
-    pending_tasks = Task.objects.filter(
-        reminder_time__lte=now,  # Время напоминания <= текущее время
-        reminder_time__isnull=False,   # У задачи есть время напоминания
-        notification_sent=False,       # Уведомление еще не отправлено
-        completed=False                # Задача не завершена
-    ).select_related('user__telegramprofile')  # Оптимизируем запрос
+    with transaction.atomic():  # atomic() - блокировки строк держатся до конца транзакции
+        # SELECT ... FOR UPDATE SKIP LOCKED: строки, которые сейчас забирает другой процесс, пропускаются
+        # of=('self',) - блокируем только строки задач: строки outbox присоединяются через LEFT JOIN
+        task_ids = list(
+            Task.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+                reminder_time__lte=now,  # Время напоминания <= текущее время
+                notification_sent=False,       # Уведомление еще не отправлено
+                completed=False                # Задача не завершена
+            ).filter(
+                Q(claimed_until__isnull=True) | Q(claimed_until__lt=now)  # никем не занято или аренда истекла
+            ).filter(
+                # Ошибок доставки не было, или пауза после ошибки прошла и напоминание не списано
+                Q(outbox__isnull=True) | Q(outbox__dead=False, outbox__next_attempt_at__lte=now)
+            ).order_by('reminder_time').values_list('id', flat=True)[:limit]
+        )
+        if not task_ids:
+            return []
+        
+        # Аренда: пока она не истекла, другие процессы это напоминание не трогают
+        Task.objects.filter(id__in=task_ids).update(
+            claimed_by=WORKER_ID,
+            claimed_until=now + CLAIM_LEASE
+        )
     
-    return list(pending_tasks)
+    # values_list() + iterator() - строки читаются с сервера по REMINDER_FETCH_CHUNK штук без кэша queryset,
+    # и сразу превращаются в короткие записи ReminderRecord вместо объектов Task, User и TelegramProfile
+    rows = Task.objects.filter(id__in=task_ids).values_list(
+        'id', 'title', 'description', 'created_at', 'reminder_time',
+        'user__username', 'user__telegramprofile__telegram_chat_id'  # профиля может не быть - тогда None
+    ).iterator(chunk_size=REMINDER_FETCH_CHUNK)
+    return [ReminderRecord(*row) for row in rows]
 
-# Функция для отметки уведомления как отправленного
-@sync_to_async
-def mark_notification_sent(task_id):
-    """Помечает уведомление как отправленное"""
+# Функция загрузки ближайших напоминаний для планировщика
+@db_async
+def get_upcoming_reminders(until):
+    """Возвращает пары (id, время напоминания) для неотправленных напоминаний до момента until"""
+    now = timezone.now()
+    # После ошибки доставки напоминание срабатывает не раньше времени следующей попытки
+    pending = Task.objects.filter(
+        notification_sent=False,
+        completed=False
+    ).filter(
+        Q(outbox__isnull=True) | Q(outbox__dead=False)  # списанные напоминания не планируем
+    ).annotate(
+        due=Greatest('reminder_time', 'outbox__next_attempt_at')
+    )
+    # Будущие напоминания до горизонта
+    upcoming = pending.filter(
+        reminder_time__lte=until, due__gt=now, due__lte=until
+    ).values_list('id', 'due')  # values_list() - берём только нужные колонки, без создания объектов модели
+    # Из уже наступивших - только самое раннее: оно будит планировщик, а все наступившие
+    # забирает из базы check_and_send_notifications пачками
+    # Без этого: после простоя в кучу попадала бы вся очередь неотправленных напоминаний
+    overdue = pending.filter(
+        reminder_time__lte=now, due__lte=now
+    ).order_by('reminder_time').values_list('id', 'due')[:1]
+
+    return list(overdue) + list(upcoming)
+
+# Функция продления аренды напоминаний
+@db_async
+def extend_claims(task_ids):
+    """Продлевает аренду ещё не доставленных напоминаний этого процесса; возвращает число продлённых"""
+    # claimed_by=WORKER_ID - напоминания с записанной ошибкой уже без аренды, а чужие не трогаем
+    return Task.objects.filter(id__in=task_ids, claimed_by=WORKER_ID, notification_sent=False).update(
+        claimed_until=timezone.now() + CLAIM_LEASE
+    )
+
+# Функция для отметки уведомлений как отправленных
+@db_async
+def mark_notifications_sent(task_ids):
+    """Помечает уведомления как отправленные одним запросом UPDATE; возвращает число помеченных"""
+    # Заодно снимаем аренду - напоминание больше никому не нужно
+    # notification_sent=False - уже помеченные строки не переписываются и не попадают в результат
+    return Task.objects.filter(id__in=task_ids, notification_sent=False).update(  # update() - массовое обновление без загрузки объектов
+        notification_sent=True,
+        # Время отметки позже отправки не больше чем на MARK_SENT_FLUSH_INTERVAL секунд
+        notified_at=Now(),
+        notification_attempts=DbF('notification_attempts') + 1,  # успешная попытка тоже считается
+        claimed_by='',
+        claimed_until=None
+    )
+
+# Функция паузы перед следующей попыткой доставки
+def retry_delay(attempts):
+    """Пауза после attempts неудачных попыток: 1, 2, 4 ... минут, но не больше OUTBOX_RETRY_MAX"""
+    return min(OUTBOX_RETRY_BASE * 2 ** (attempts - 1), OUTBOX_RETRY_MAX)
+
+# Функция записи неудачной доставки в outbox
+@db_async
+def record_notification_failure(task_id, error, permanent=False):  # permanent - повторять бесполезно
+    """Записывает ошибку доставки: назначает следующую попытку или списывает напоминание"""
+    now = timezone.now()
     try:
-        task = Task.objects.get(id=task_id)
-        task.notification_sent = True
-        task.save()
+        with transaction.atomic():
+            outbox, created = NotificationOutbox.objects.select_for_update().get_or_create(
+                task_id=task_id, defaults={'next_attempt_at': now}
+            )
+            outbox.attempts += 1
+            outbox.last_error = error[:1000]
+            outbox.dead = permanent or outbox.attempts >= OUTBOX_MAX_ATTEMPTS
+            outbox.next_attempt_at = now + retry_delay(outbox.attempts)
+            outbox.save()
+            # Снимаем аренду: теперь время следующей попытки задаёт outbox
+            Task.objects.filter(id=task_id).update(
+                claimed_by='', claimed_until=None, notification_attempts=DbF('notification_attempts') + 1
+            )
+            # Планировщики всех процессов бота переносят (или снимают) напоминание
+            if outbox.dead:
+                notify_reminder_changed(task_id)
+            else:
+                notify_reminder_changed(task_id, outbox.next_attempt_at)
+    except IntegrityError:  # задачу удалили, пока шла отправка - записывать некуда
+        return None
+    return outbox
+
+# Функция определения ошибок, после которых в чат писать бесполезно
+def is_chat_gone(error):
+    """True, если бот заблокирован пользователем или чат не существует"""
+    if isinstance(error, TelegramForbiddenError):
         return True
-    except Task.DoesNotExist:
-        return False
+    return isinstance(error, TelegramBadRequest) and "chat not found" in str(error).lower()
+
+# Накопитель доставленных напоминаний
+class NotificationSentBatcher:
+    """Копит id доставленных напоминаний и помечает их пачками"""
+
+    def __init__(self, batch_size=MARK_SENT_BATCH_SIZE, flush_interval=MARK_SENT_FLUSH_INTERVAL):
+        self.batch_size = batch_size  # при таком количестве id пачка записывается сразу
+        self.flush_interval = flush_interval  # не дольше стольких секунд id ждут записи
+        self.task_ids = []
+        self.timer = None  # отложенная запись неполной пачки
+
+    async def add(self, task_id):
+        """Добавляет id доставленного напоминания"""
+        self.task_ids.append(task_id)
+        if len(self.task_ids) >= self.batch_size:
+            await self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self):
+        """Записывает неполную пачку через flush_interval секунд"""
+        await asyncio.sleep(self.flush_interval)
+        self.timer = None
+        await self.flush()
+
+    async def flush(self):
+        """Помечает все накопленные напоминания как отправленные"""
+        if self.timer is not None and self.timer is not asyncio.current_task():
+            self.timer.cancel()  # пачка записывается сейчас - отложенная запись не нужна
+        self.timer = None
+
+        # Забираем список до await, чтобы новые id копились уже в следующую пачку
+        task_ids = self.task_ids
+        self.task_ids = []
+        if task_ids:
+            await mark_notifications_sent(task_ids)
+
+# Функция текста напоминания об одной задаче
+def reminder_text(task):
+    """Полный текст напоминания об одной задаче"""
+    # Формируем текст описания
+    desc_text = ""
+    if task.description:
+        desc_text = "\n📝 <i>" + html.escape(task.description) + "</i>\n"
+    return (
+        f"⏰ <b>НАПОМИНАНИЕ!</b>\n\n🔔 <b>{html.escape(task.title)}</b>\n{desc_text}"
+        f"\n📅 Создано: {timezone.localtime(task.created_at).strftime('%d.%m.%Y %H:%M')}\n"  # localtime() - функция преобразования времени в локальный часовой пояс
+        f"⏰ Время: {timezone.localtime(task.reminder_time).strftime('%d.%m.%Y %H:%M')}\n\n"
+        f"💡 Команда <code>/tasksTime</code> покажет все напоминания"
+    )
+
+# Функция блока одной задачи в дайджесте
+def digest_block(task):
+    """Короткий блок задачи для сообщения с несколькими напоминаниями"""
+    desc_text = ""
+    if task.description:
+        # Длинное описание обрезаем, чтобы блоки помещались в лимит; экранируем после обрезки, чтобы не разрезать &amp;
+        desc_text = "📝 <i>" + html.escape(short_description(task.description)) + "</i>\n"
+    return ("🔔 <b>" + html.escape(task.title) + "</b>\n" + desc_text
+            + "⏰ " + timezone.localtime(task.reminder_time).strftime('%d.%m.%Y %H:%M') + "\n\n")
+
+# Функция сообщений для группы напоминаний одного чата
+def group_messages(chat_id, group):
+    """Одно напоминание - обычное сообщение, несколько - дайджест, разбитый по лимиту Telegram"""
+    if len(group) == 1:
+        return [ReminderMessage(chat_id, reminder_text(group[0]), group)]
+
+    messages = []
+    builder = None
+    included = []  # задачи текущего сообщения дайджеста
+    for task in group:
+        block = digest_block(task)
+        if builder is None or not builder.add(block):
+            # Сообщение заполнено - начинаем следующее
+            if builder is not None:
+                messages.append(ReminderMessage(chat_id, builder.text(), included))
+            builder = MessageBuilder(DIGEST_HEADER, DIGEST_FOOTER)
+            builder.add(block)
+            included = []
+        included.append(task)
+    messages.append(ReminderMessage(chat_id, builder.text(), included))
+    return messages
+
+# Функция группировки напоминаний по чатам
+def build_reminder_messages(tasks, window=REMINDER_DIGEST_WINDOW):
+    """Собирает сообщения для отправки: напоминания чата в пределах окна window идут одним дайджестом"""
+    by_chat = {}  # chat_id -> напоминания чата по возрастанию времени
+    for task in sorted(tasks, key=lambda task: task.reminder_time):
+        by_chat.setdefault(task.chat_id, []).append(task)
+
+    messages = []
+    for chat_id, chat_tasks in by_chat.items():
+        group = []
+        for task in chat_tasks:
+            # Окно отсчитывается от первого напоминания группы
+            if group and (not window or task.reminder_time - group[0].reminder_time > window):
+                messages.extend(group_messages(chat_id, group))
+                group = []
+            group.append(task)
+        messages.extend(group_messages(chat_id, group))
+    return messages
 
 # Функция для отправки уведомления пользователю
-async def send_notification(task):  # async функция - асинхронная функция для отправки уведомлений
-    """Отправляет уведомление о напоминании пользователю в Telegram"""
+async def send_notification(message, bot=BOT):  # message - ReminderMessage; bot - объект бота, в тестах можно передать поддельный
+    """Отправляет сообщение с напоминаниями пользователю в Telegram"""
+    # Проверяем наличие chat_id для отправки (None - бот не подключен)
+    if not message.chat_id:
+        return False
     try:  # try блок - обработка исключений
-        # Проверяем наличие Telegram профиля
-        if not hasattr(task.user, 'telegramprofile'):  # hasattr() - функция проверки наличия атрибута у объекта
-            return False
-        
-        # Проверяем наличие chat_id для отправки
-        if not task.user.telegramprofile.telegram_chat_id:
-            return False
-        
-        chat_id = task.user.telegramprofile.telegram_chat_id  # переменная с ID чата для отправки сообщения
-        
-        # Формируем текст описания
-        desc_text = ""
-        if task.description:
-            desc_text = "\n📝 _" + task.description + "_\n"
-        message = (  # переменная с текстом сообщения
-            f"⏰ *НАПОМИНАНИЕ!*\n\n🔔 *{task.title}*\n{desc_text}"
-            f"\n📅 Создано: {timezone.localtime(task.created_at).strftime('%d.%m.%Y %H:%M')}\n"  # localtime() - функция преобразования времени в локальный часовой пояс
-            f"⏰ Время: {timezone.localtime(task.reminder_time).strftime('%d.%m.%Y %H:%M')}\n\n"
-            f"💡 Команда `/tasksTime` покажет все напоминания"
-        )
-        
-        # Отправляем уведомление и помечаем как отправленное
-        await BOT.send_message(chat_id=chat_id, text=message, parse_mode='Markdown')  # BOT.send_message() - метод отправки сообщений в Telegram; parse_mode='Markdown' - параметр форматирования текста
-        await mark_notification_sent(task.id)  # mark_notification_sent() - функция отметки уведомления как отправленного
+        # Отправляем уведомление (отметку об отправке пачкой делает диспетчер)
+        await bot.send_message(chat_id=message.chat_id, text=message.text, parse_mode=REMINDER_PARSE_MODE)  # send_message() - метод отправки сообщений в Telegram; parse_mode - параметр форматирования текста
         return True
-        
+
     except Exception as e:  # Exception - базовый класс всех исключений Python
-        task_id = str(task.id)
-        print("Ошибка отправки уведомления для задачи " + task_id + ": " + str(e))  # вывод ошибки в консоль
-        return False
+        # Паузу RetryAfter выдерживает, а остальные ошибки записывает в outbox диспетчер
+        if not isinstance(e, TelegramRetryAfter):
+            task_ids = ", ".join(str(task.id) for task in message.tasks)
+            print("Ошибка отправки уведомления для задач " + task_ids + ": " + str(e))  # вывод ошибки в консоль
+        raise
+
+# Статистика доставки напоминаний этим процессом (с момента запуска)
+class DeliveryStats:
+    """Задержки доставки, скорость отправки, ошибки по классам и время проверок"""
+
+    def __init__(self, samples=DELIVERY_LAG_SAMPLES):
+        self.started = time.monotonic()
+        self.lags = deque(maxlen=samples)  # задержки последних доставок в секундах; старые вытесняются
+        self.sent = 0  # доставлено напоминаний
+        self.messages = 0  # отправлено сообщений (дайджест - одно сообщение на несколько напоминаний)
+        self.failed = 0
+        self.errors = Counter()  # класс ошибки -> сколько напоминаний не доставлено
+        self.ticks = 0  # проверок наступивших напоминаний
+        self.scan_seconds = 0.0  # сколько всего заняли запросы захвата напоминаний
+        self.last_scan = 0.0
+        self.last_backlog = 0  # сколько напоминаний было наступившими в последнюю проверку
+
+    def record_sent(self, tasks):
+        """Учитывает доставленное сообщение с напоминаниями tasks"""
+        now = timezone.now()
+        self.messages += 1
+        self.sent += len(tasks)
+        for task in tasks:
+            self.lags.append((now - task.reminder_time).total_seconds())
+
+    def record_failed(self, count, error_class):
+        """Учитывает count недоставленных напоминаний с ошибкой error_class"""
+        self.failed += count
+        self.errors[error_class] += count
+
+    def record_tick(self, scan_seconds, backlog):
+        """Учитывает одну проверку: время запросов захвата и число наступивших напоминаний"""
+        self.ticks += 1
+        self.scan_seconds += scan_seconds
+        self.last_scan = scan_seconds
+        self.last_backlog = backlog
+
+    def percentile(self, fraction):
+        """Задержка доставки, которую не превышает доля fraction последних доставок (None - доставок не было)"""
+        if not self.lags:
+            return None
+        ordered = sorted(self.lags)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def report(self):
+        """Строка статистики для лога"""
+        uptime = time.monotonic() - self.started
+        lags = " / ".join(
+            "-" if value is None else str(round(value, 1))
+            for value in (self.percentile(0.5), self.percentile(0.95), self.percentile(0.99))
+        )
+        errors = ", ".join(name + ": " + str(count) for name, count in self.errors.most_common()) or "нет"
+        return ("📈 Задержка p50/p95/p99: " + lags + " с | Доставлено: " + str(self.sent)
+                + " (" + str(round(self.sent / uptime, 2) if uptime > 0 else 0) + " в секунду, сообщений: " + str(self.messages) + ")"
+                + " | Очередь: " + str(self.last_backlog)
+                + " | Проверка: " + str(round(self.last_scan * 1000)) + " мс"
+                + " | Ошибки: " + errors)
+
+    def metrics(self):
+        """Статистика в текстовом формате Prometheus (для порта метрик бота)"""
+        lines = [
+            '# TYPE stem_bot_reminders_sent_total counter',
+            'stem_bot_reminders_sent_total ' + str(self.sent),
+            '# TYPE stem_bot_reminder_messages_total counter',
+            'stem_bot_reminder_messages_total ' + str(self.messages),
+            '# TYPE stem_bot_reminders_failed_total counter',
+        ]
+        for error_class, count in sorted(self.errors.items()):
+            lines.append('stem_bot_reminders_failed_total{error="' + error_class + '"} ' + str(count))
+        # summary - процентили задержки по последним DELIVERY_LAG_SAMPLES доставкам
+        lines.append('# TYPE stem_bot_delivery_lag_seconds summary')
+        for fraction in (0.5, 0.95, 0.99):
+            value = self.percentile(fraction)
+            if value is not None:
+                lines.append('stem_bot_delivery_lag_seconds{quantile="' + str(fraction) + '"} ' + str(value))
+        lines += [
+            '# TYPE stem_bot_reminder_backlog gauge',
+            'stem_bot_reminder_backlog ' + str(self.last_backlog),
+            '# TYPE stem_bot_scan_seconds_total counter',
+            'stem_bot_scan_seconds_total ' + str(self.scan_seconds),
+            '# TYPE stem_bot_scans_total counter',
+            'stem_bot_scans_total ' + str(self.ticks),
+        ]
+        return lines
+
+# Статистика доставки этого процесса
+DELIVERY_STATS = DeliveryStats()
+
+# Ведро токенов для ограничения скорости отправки
+class TokenBucket:
+    """Разрешает не больше rate операций в секунду с запасом capacity"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate  # сколько токенов добавляется в секунду
+        self.capacity = capacity  # максимальный запас токенов
+        self.tokens = capacity
+        self.updated = time.monotonic()  # monotonic() - часы, которые не переводятся назад
+        self.lock = asyncio.Lock()  # Lock - ожидающие получают токены по очереди
+
+    def refill(self):
+        """Добавляет токены за прошедшее время"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Ждёт, пока появится токен, и забирает его"""
+        async with self.lock:
+            self.refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= 1
+
+    def pause(self, seconds):
+        """Запрещает отправку на seconds секунд (ответ Telegram RetryAfter)"""
+        self.refill()
+        # Отрицательный запас - "долг", который восстановится ровно через seconds секунд
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+# Диспетчер параллельной отправки напоминаний
+# Один диспетчер на процесс (создаётся в notification_worker): вёдра токенов и долг после RetryAfter
+# переживают границы пачек и проверок
+# Без этого: на каждой пачке вёдра снова были бы полными и лимиты Telegram превышались бы на стыках
+class NotificationDispatcher:
+    """Отправляет напоминания параллельно, соблюдая общий лимит Telegram и лимит на чат"""
+
+    def __init__(self, bot=BOT, concurrency=SEND_CONCURRENCY,
+                 global_rate=GLOBAL_RATE_LIMIT, chat_rate=CHAT_RATE_LIMIT, renew_interval=CLAIM_RENEW_INTERVAL):
+        self.bot = bot
+        self.renew_interval = renew_interval.total_seconds()  # как часто продлевать аренду отправляемой пачки
+        self.semaphore = asyncio.Semaphore(concurrency)  # Semaphore - ограничивает число одновременных отправок
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self.chat_rate = chat_rate
+        self.chat_buckets = {}  # chat_id -> TokenBucket
+        self.sent_batcher = NotificationSentBatcher()  # отметка доставленных пачками
+        # Статистика с запуска процесса (sent и failed - в напоминаниях, messages - в сообщениях Telegram)
+        self.messages = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+
+    def get_chat_bucket(self, chat_id):
+        """Возвращает ведро токенов для конкретного чата"""
+        if chat_id not in self.chat_buckets:
+            self.chat_buckets[chat_id] = TokenBucket(self.chat_rate)
+        return self.chat_buckets[chat_id]
+
+    def prune_chat_buckets(self):
+        """Удаляет вёдра чатов, которые успели наполниться: новое ведро ничем от них не отличается"""
+        for chat_id, bucket in list(self.chat_buckets.items()):
+            if bucket.lock.locked():  # в это ведро кто-то ждёт токен
+                continue
+            bucket.refill()
+            if bucket.tokens >= bucket.capacity:
+                del self.chat_buckets[chat_id]
+
+    async def deliver(self, message):
+        """Отправляет одно сообщение с напоминаниями с учётом лимитов и пауз RetryAfter"""
+        chat_id = message.chat_id
+        notification_sent = False
+        error = "Telegram просит подождать (RetryAfter)"  # если все попытки упрутся в лимит
+        error_class = "TelegramRetryAfter"  # класс ошибки для статистики
+        permanent = False
+        chat_gone = False
+        for attempt in range(MAX_RETRY_AFTER):
+            if chat_id:
+                # Очередь чата ждём до семафора: иначе сообщения одного чата заняли бы все места отправки
+                await self.get_chat_bucket(chat_id).acquire()
+            async with self.semaphore:
+                if chat_id:
+                    await self.global_bucket.acquire()
+                try:
+                    notification_sent = await send_notification(message, self.bot)
+                    if not notification_sent:
+                        # Бот не подключен к профилю - до нового напоминания писать некуда
+                        error = "Бот не подключен к профилю"
+                        error_class = "NoChat"
+                        permanent = True
+                    break
+                except TelegramRetryAfter as e:  # Telegram просит подождать retry_after секунд
+                    self.retries += 1
+                    self.global_bucket.pause(e.retry_after)
+                    print("⏳ Лимит Telegram, пауза " + str(e.retry_after) + " с")
+                except Exception as e:  # ошибка сети или ответ Telegram
+                    error_class = type(e).__name__
+                    error = error_class + ": " + str(e)
+                    permanent = chat_gone = is_chat_gone(e)
+                    break
+
+        if chat_gone:
+            # Бот заблокирован или чат удалён - отвязываем чат, чтобы не писать в него снова
+            await disconnect_user(chat_id)
+            print("🚫 Чат " + str(chat_id) + " недоступен, отвязан от профиля")
+
+        if notification_sent:
+            self.messages += 1
+            for task in message.tasks:  # все задачи дайджеста попадают в одну пачку UPDATE
+                await self.sent_batcher.add(task.id)
+            self.sent += len(message.tasks)
+            DELIVERY_STATS.record_sent(message.tasks)
+            status = "✅"
+        else:
+            # Следующая попытка - с паузой; недоставляемые напоминания списываются сразу
+            for task in message.tasks:
+                await record_notification_failure(task.id, error, permanent)
+            self.failed += len(message.tasks)
+            DELIVERY_STATS.record_failed(len(message.tasks), error_class)
+            status = "❌"
+        first = message.tasks[0]
+        if len(message.tasks) == 1:
+            print(status + " " + first.title + " -> " + first.username)
+        else:
+            print(status + " Дайджест из " + str(len(message.tasks)) + " напоминаний -> " + first.username)
+        return notification_sent
+
+    async def renew_claims(self, task_ids):
+        """Продлевает аренду пачки каждые renew_interval секунд, пока её не отменят"""
+        while True:
+            await asyncio.sleep(self.renew_interval)
+            try:
+                await extend_claims(task_ids)
+            except Exception as e:  # база недоступна - попробуем в следующий раз
+                print("❌ Не удалось продлить аренду напоминаний: " + str(e))
+
+    async def dispatch(self, tasks):
+        """Отправляет все напоминания и печатает скорость отправки"""
+        started = time.monotonic()
+        # Счётчики до этой пачки: в строку статистики попадает только она
+        sent_before, failed_before = self.sent, self.failed
+        messages_before, retries_before = self.messages, self.retries
+        self.prune_chat_buckets()
+        renewer = asyncio.create_task(self.renew_claims([task.id for task in tasks]))
+        try:
+            # Напоминания одного чата в пределах окна склеиваются в дайджест
+            messages = build_reminder_messages(tasks)
+            # gather() - запускает отправки одновременно, семафор ограничивает их число
+            await asyncio.gather(*(self.deliver(message) for message in messages))
+        finally:
+            renewer.cancel()
+            # Дописываем последнюю пачку, иначе эти напоминания отправились бы повторно
+            await self.sent_batcher.flush()
+        elapsed = time.monotonic() - started
+
+        sent, failed = self.sent - sent_before, self.failed - failed_before
+        rate = 0
+        if elapsed > 0:
+            rate = round((sent + failed) / elapsed, 1)
+        print("📊 Отправлено: " + str(sent) + " (сообщений: " + str(self.messages - messages_before) + ") | Ошибок: " + str(failed)
+              + " | Пауз RetryAfter: " + str(self.retries - retries_before)
+              + " | " + str(round(elapsed, 1)) + " с (" + str(rate) + " в секунду)")
 
 # Основная функция проверки и отправки напоминаний
-async def check_and_send_notifications():  # функция проверки и отправки уведомлений
+async def check_and_send_notifications(bot=BOT, dispatcher=None):  # dispatcher - диспетчер процесса (None - новый на эту проверку)
     """Проверяет и отправляет все pending уведомления"""
+    if dispatcher is None:
+        dispatcher = NotificationDispatcher(bot)
+    scan_seconds = 0.0  # время запросов захвата за эту проверку
+    backlog = 0  # сколько наступивших напоминаний забрано за эту проверку
     try:
-        pending_tasks = await get_pending_notifications()  # получаем список задач для уведомлений
-        if not pending_tasks:
-            return
-        
-        pending_count = str(len(pending_tasks))
-        print("📤 Найдено " + pending_count + " напоминаний для отправки")
-        
-        # Отправляем уведомления с паузой между отправками
-        for task in pending_tasks:  # цикл по каждой задаче
-            # Отправляем уведомление и определяем статус
-            notification_sent = await send_notification(task)
-            if notification_sent:
-                status = "✅"
-            else:
-                status = "❌"
-            print(status + " " + task.title + " -> " + task.user.username)
-            await asyncio.sleep(0.5)  # sleep() - функция паузы на 0.5 секунды
+        # Забираем напоминания пачками, пока наступившие не закончатся
+        # Неотправленные получают время следующей попытки в outbox
+        while True:
+            started = time.monotonic()
+            pending_tasks = await claim_pending_notifications()  # получаем список задач для уведомлений
+            scan_seconds += time.monotonic() - started
+            if not pending_tasks:
+                break
+            backlog += len(pending_tasks)
+            
+            pending_count = str(len(pending_tasks))
+            print("📤 Найдено " + pending_count + " напоминаний для отправки")
+            
+            # Отправляем уведомления параллельно с ограничением скорости (вёдра общие для всех пачек)
+            await dispatcher.dispatch(pending_tasks)
             
     except Exception as e:  # обработка любых ошибок в функции
         print("❌ Ошибка в check_and_send_notifications: " + str(e))
+    DELIVERY_STATS.record_tick(scan_seconds, backlog)
+    if backlog:
+        print(DELIVERY_STATS.report())
+
+# Планировщик напоминаний на основе min-кучи
+class ReminderScheduler:
+    """Хранит ближайшие напоминания в куче и спит ровно до самого раннего из них"""
+
+    def __init__(self, horizon=SCHEDULER_HORIZON, dispatcher=None):
+        self.horizon = horizon  # на сколько вперёд загружаем напоминания из БД
+        self.dispatcher = dispatcher or NotificationDispatcher()  # один диспетчер на все проверки
+        self.heap = []  # куча пар (время напоминания, id задачи)
+        self.planned = {}  # id задачи -> актуальное время; записи кучи с другим временем считаются удалёнными
+        self.loaded_until = None  # момент, до которого куча заполнена из БД
+        self.changes_during_load = None  # изменения, пришедшие пока идёт загрузка из БД
+        self.wakeup = asyncio.Event()  # Event - будит планировщик при изменении кучи
+        # Lock - загрузки идут по очереди: run() и change_listener() могут вызвать load() одновременно
+        # Без этого: загрузка, закончившаяся первой, обнуляла бы буфер изменений второй
+        self.load_lock = asyncio.Lock()
+
+    async def load(self):
+        """Перезагружает кучу из БД на горизонт вперёд"""
+        async with self.load_lock:
+            await self.load_locked()
+
+    async def load_locked(self):
+        """Перезагрузка кучи; вызывается только из load() под блокировкой"""
+        until = timezone.now() + self.horizon
+        self.changes_during_load = []
+        try:
+            rows = await get_upcoming_reminders(until)
+        except Exception:
+            self.changes_during_load = None
+            raise
+
+        self.planned = {}
+        for task_id, reminder_time in rows:
+            self.planned[task_id] = reminder_time
+        self.heap = [(reminder_time, task_id) for task_id, reminder_time in self.planned.items()]
+        heapq.heapify(self.heap)  # heapify() - превращает список в кучу за O(n)
+        self.loaded_until = until
+
+        # Применяем изменения, которые могли не попасть в прочитанные строки
+        changes = self.changes_during_load
+        self.changes_during_load = None
+        for task_id, reminder_time in changes:
+            self.schedule(task_id, reminder_time)
+        self.wakeup.set()
 
-# Фоновая задача для периодической проверки напоминаний
+    def schedule(self, task_id, reminder_time):
+        """Добавляет или переносит напоминание (None - отменяет его)"""
+        if self.changes_during_load is not None:
+            self.changes_during_load.append((task_id, reminder_time))
+            return
+
+        # Напоминания за горизонтом подхватятся при следующей загрузке
+        if reminder_time is None or self.loaded_until is None or reminder_time > self.loaded_until:
+            self.planned.pop(task_id, None)  # старая запись в куче станет "мёртвой"
+            return
+
+        self.planned[task_id] = reminder_time
+        heapq.heappush(self.heap, (reminder_time, task_id))  # heappush() - добавление в кучу за O(log n)
+        self.wakeup.set()
+
+    def pop_due(self, now):
+        """Достаёт из кучи все напоминания, время которых наступило"""
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            reminder_time, task_id = heapq.heappop(self.heap)
+            # Пропускаем отменённые и перенесённые записи
+            if self.planned.get(task_id) == reminder_time:
+                del self.planned[task_id]
+                due.append(task_id)
+        return due
+
+    def next_wakeup(self):
+        """Возвращает момент, когда планировщику нужно проснуться"""
+        # Убираем с вершины кучи "мёртвые" записи
+        while self.heap and self.planned.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+
+        if self.heap and self.heap[0][0] < self.loaded_until:
+            return self.heap[0][0]
+        return self.loaded_until  # напоминаний нет - просыпаемся для загрузки следующего горизонта
+
+    async def run(self):
+        """Основной цикл: отправка наступивших напоминаний и сон до следующего"""
+        await self.load()
+        while True:
+            self.wakeup.clear()
+            now = timezone.now()
+
+            if now >= self.loaded_until:
+                await self.load()
+                continue
+
+            if self.pop_due(now):
+                await check_and_send_notifications(dispatcher=self.dispatcher)
+
+            # Спим до ближайшего напоминания или до сигнала об изменениях
+            timeout = (self.next_wakeup() - timezone.now()).total_seconds()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=max(timeout, 0))
+            except asyncio.TimeoutError:  # TimeoutError - время сна истекло, пора отправлять
+                pass
+
+# Фоновая задача получения изменений от сайта
+# scheduler=None - только сброс кэша чатов (обработка webhook в ASGI-процессах сайта, без планировщика)
+async def change_listener(scheduler=None):
+    """Слушает каналы PostgreSQL LISTEN/NOTIFY: изменения напоминаний и привязок чатов"""
+    # psycopg (версия 3) - асинхронный драйвер PostgreSQL
+    # Без него: изменения подхватываются только при перезагрузке горизонта
+    try:
+        import psycopg
+    except ImportError:
+        print("⚠️ psycopg не установлен, изменения подхватываются только по сроку жизни кэша и горизонта")
+        return
+
+    db = settings.DATABASES['default']
+    while True:
+        try:
+            conn = await psycopg.AsyncConnection.connect(
+                dbname=db['NAME'],
+                user=db.get('USER'),
+                password=db.get('PASSWORD'),
+                host=db.get('HOST'),
+                port=db.get('PORT'),
+                autocommit=True  # autocommit=True - LISTEN работает вне транзакции
+            )
+            async with conn:
+                if scheduler is not None:
+                    await conn.execute("LISTEN " + REMINDER_CHANNEL)
+                await conn.execute("LISTEN " + CHAT_CHANNEL)
+                if LOCAL_CACHE:
+                    # Кэш ответов в памяти процесса: версии задач, увеличенные сайтом, до нас не доходят сами
+                    await conn.execute("LISTEN " + TASKS_CHANNEL)
+                # Пока соединения не было, могли пропустить изменения - перечитываем горизонт и сбрасываем кэши
+                CHAT_USERS.clear()
+                clear_local_replies()
+                if scheduler is not None:
+                    await scheduler.load()
+                async for notify in conn.notifies():  # notifies() - асинхронный поток сообщений NOTIFY
+                    if notify.channel == CHAT_CHANNEL:
+                        CHAT_USERS.invalidate(int(notify.payload))  # привязка чата изменилась
+                        continue
+                    if notify.channel == TASKS_CHANNEL:
+                        for user_id in notify.payload.split(","):
+                            bump_tasks_version(int(user_id))  # задачи пользователя изменились
+                        continue
+                    task_id, reminder_time = notify.payload.split(":", 1)
+                    if reminder_time:
+                        scheduler.schedule(int(task_id), datetime.fromisoformat(reminder_time))
+                    else:
+                        scheduler.schedule(int(task_id), None)
+        except Exception as e:
+            print("❌ Ошибка в change_listener: " + str(e))
+            await asyncio.sleep(5)  # пауза перед переподключением
+
+# Фоновая задача отправки напоминаний
 async def notification_worker():  # фоновая задача для проверки напоминаний
-    """Фоновая задача проверки напоминаний каждые 60 секунд"""
-    print("🔔 Запущен сервис напоминаний (проверка каждые 60 секунд)")
+    """Фоновая задача: планировщик напоминаний и слушатель изменений с сайта"""
+    print("🔔 Запущен сервис напоминаний (планировщик на куче)")
+    # Диспетчер с вёдрами токенов создаётся один раз на процесс и переживает перезапуски планировщика
+    scheduler = ReminderScheduler(dispatcher=NotificationDispatcher())
+    asyncio.create_task(change_listener(scheduler))
     while True:  # бесконечный цикл работы
         try:
-            await check_and_send_notifications()
+            await scheduler.run()
         except Exception as e:  # перехват любых ошибок в цикле
             print("❌ Ошибка в notification_worker: " + str(e))
-        finally:  # finally блок - выполняется в любом случае
-            await asyncio.sleep(60)  # пауза 60 секунд между проверками
+            await asyncio.sleep(5)  # пауза перед перезапуском планировщика
+
+# Фоновая задача пометки просроченных задач
+async def overdue_worker():
+    """Раз в минуту помечает просроченными напоминания всех пользователей"""
+    while True:
+        try:
+            marked = await db_async(sweep_overdue_tasks)()
+            if marked:
+                print("🔴 Помечено просроченных задач: " + str(marked))
+        except Exception as e:
+            print("❌ Ошибка в overdue_worker: " + str(e))
+        await asyncio.sleep(OVERDUE_SWEEP_INTERVAL)
 
 # Создаём диспетчер для обработки сообщений
 dp = Dispatcher() 
 
+# Middleware замера обработчиков: время и запросы к базе каждой команды и нажатия кнопки
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Записывает время обработчика и его запросы к базе с меткой handler (имя функции)"""
+
+    async def __call__(self, handler, event, data):
+        timer = RequestTimer()
+        try:
+            return await handler(event, data)
+        finally:
+            # data['handler'] - обработчик, фильтры которого подошли (middleware вызывается уже после фильтров)
+            handler_object = data.get('handler')
+            timer.finish('bot', 'handler', handler_object.callback.__name__ if handler_object else 'unknown')
+
+dp.message.middleware(HandlerMetricsMiddleware())
+dp.callback_query.middleware(HandlerMetricsMiddleware())
+
 # Обработчик команды /start - проверяет соединение и приветствует пользователя
 @dp.message(Command("start"))  # @dp.message() - декоратор обработчика сообщений; Command("start") - фильтр для команды /start
 async def command_start_handler(message):  # обработчик команды - async функция
@@ -358,24 +1364,51 @@ async def command_login_handler(message, command: CommandObject):  # CommandObje
 async def command_tasks_handler(message):
     """Команда для просмотра заметок (задачи без времени напоминания)"""
     user = await get_user_by_chat_id(message.chat.id)
-    notes = await get_user_tasks_filtered(user, "notes")
-    await message.answer(notes, parse_mode='Markdown')
+    notes, next_cursor = await get_user_tasks_filtered(user, "notes")
+    await message.answer(notes, parse_mode='Markdown', reply_markup=tasks_keyboard("notes", None, next_cursor))
 
 # Обработчик команды /tasksTime - показывает напоминания (с временем)
 @dp.message(Command("tasksTime"))
 async def command_tasks_time_handler(message):
     """Команда для просмотра напоминаний (задачи с временем напоминания)"""
     user = await get_user_by_chat_id(message.chat.id)
-    reminders = await get_user_tasks_filtered(user, "reminders")
-    await message.answer(reminders, parse_mode='Markdown')
+    reminders, next_cursor = await get_user_tasks_filtered(user, "reminders")
+    await message.answer(reminders, parse_mode='Markdown', reply_markup=tasks_keyboard("reminders", None, next_cursor))
 
 # Обработчик команды /taskAll - показывает все задачи с разделением по категориям
 @dp.message(Command("taskAll"))
 async def command_task_all_handler(message):
     """Команда для просмотра всех задач пользователя, разделенных по статусу"""
     user = await get_user_by_chat_id(message.chat.id)
-    tasks = await get_all_tasks(user)
-    await message.answer(tasks, parse_mode='Markdown')
+    tasks, next_cursor = await get_all_tasks(user)
+    await message.answer(tasks, parse_mode='Markdown', reply_markup=tasks_keyboard("all", None, next_cursor))
+
+# Обработчик кнопок "Дальше" / "В начало" под списками задач
+@dp.callback_query(F.data.startswith("tasks:"))  # F.data - данные нажатой кнопки
+async def tasks_page_handler(callback):
+    """Показывает другую страницу списка задач в том же сообщении"""
+    parts = callback.data.split(":", 2)
+    if len(parts) != 3 or parts[1] not in TASKS_CURSOR_FORMATS:
+        await callback.answer()
+        return
+    kind = parts[1]
+    # Неверный курсор - показываем первую страницу
+    cursor = valid_tasks_cursor(kind, parts[2])
+    try:
+        user = await get_user_by_chat_id(callback.message.chat.id)
+        if kind == "all":
+            text, next_cursor = await get_all_tasks(user, cursor)
+        else:
+            text, next_cursor = await get_user_tasks_filtered(user, kind, cursor)
+        # edit_text() - заменяем текст сообщения, чтобы страницы не засоряли чат
+        await callback.message.edit_text(text, parse_mode='Markdown', reply_markup=tasks_keyboard(kind, cursor, next_cursor))
+    except TelegramBadRequest as e:
+        # "message is not modified" - ту же страницу нажали ещё раз; остальное (например, ошибку разметки) пишем в лог
+        if "message is not modified" not in str(e):
+            print("❌ Не удалось показать страницу задач: " + str(e))
+    finally:
+        # answer() - убираем "часики" на кнопке; без finally они крутились бы после любой ошибки
+        await callback.answer()
 
 # Обработчик команды /help - показывает справку по командам
 @dp.message(Command("help"))
@@ -443,12 +1476,114 @@ async def command_logout_handler(message):
             parse_mode='Markdown'
         )
 
+# === РЕЖИМ WEBHOOK ===
+# Telegram сам присылает обновления POST-запросом на сайт (ste/asgi.py передаёт их сюда)
+# Обновления обрабатываются всеми ASGI-процессами сайта параллельно, а не одним процессом polling
+
+# Задачи обработки обновлений; ссылки храним, чтобы задачи не удалил сборщик мусора до завершения
+WEBHOOK_TASKS = set()
+
+# Функция отправки простого HTTP-ответа через ASGI
+async def send_http_response(send, status):
+    """Отвечает на ASGI-запрос кодом status с пустым телом"""
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': b''})
+
+# ASGI-приложение приёма обновлений Telegram
+async def telegram_webhook(scope, receive, send):
+    """Принимает обновление Telegram, сразу отвечает 200 и обрабатывает его в фоне тем же диспетчером"""
+    # Webhook выключен, пока не задан секрет - иначе кто угодно мог бы слать боту поддельные сообщения
+    if not settings.TELEGRAM_WEBHOOK_SECRET:
+        await send_http_response(send, 404)
+        return
+    if scope['method'] != 'POST':
+        await send_http_response(send, 405)
+        return
+
+    # Telegram присылает секрет из set_webhook в заголовке X-Telegram-Bot-Api-Secret-Token
+    headers = dict(scope['headers'])
+    secret_token = headers.get(b'x-telegram-bot-api-secret-token', b'').decode()
+    if not hmac.compare_digest(secret_token, settings.TELEGRAM_WEBHOOK_SECRET):  # compare_digest() - сравнение без утечки по времени
+        await send_http_response(send, 403)
+        return
+
+    # Тело запроса может прийти несколькими частями
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+
+    try:
+        update = Update.model_validate_json(body, context={'bot': BOT})  # context={'bot': BOT} - ответы пойдут через этого бота
+    except ValueError:  # ValueError - тело не похоже на обновление Telegram
+        await send_http_response(send, 400)
+        return
+
+    # Отвечаем сразу: пока обработчик ждёт базу, Telegram не держит соединение и присылает следующие обновления
+    task = asyncio.create_task(dp.feed_update(BOT, update))
+    WEBHOOK_TASKS.add(task)
+    task.add_done_callback(WEBHOOK_TASKS.discard)
+    await send_http_response(send, 200)
+
+# Функция запуска фоновых задач бота внутри ASGI-процесса сайта
+def start_webhook_workers():
+    """Слушатель сброса кэша чатов для процессов, которые обрабатывают webhook"""
+    asyncio.create_task(change_listener())
+
+# Сервер метрик процесса бота
+async def start_metrics_server(port=None):
+    """Отдаёт метрики бота по http://127.0.0.1:port/metrics (port 0 - не запускать)"""
+    port = settings.BOT_METRICS_PORT if port is None else port
+    if not port:
+        return None
+    # aiohttp - веб-сервер, который уже установлен вместе с aiogram
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+    except OSError as e:  # порт занят (например, вторым процессом бота) - работаем без метрик
+        print("⚠️ Метрики бота не запущены на порту " + str(port) + ": " + str(e))
+        await runner.cleanup()
+        return None
+    print("📈 Метрики бота: http://127.0.0.1:" + str(port) + "/metrics")
+    return runner
+
 # Основная функция запуска бота с сервисом напоминаний
-async def main():
+async def main(webhook=False):  # webhook=True - обновления принимает сайт, этот процесс только рассылает напоминания
     """Главная функция для запуска бота и сервиса напоминаний"""
+    # Метрики: обработчики команд, запросы к базе и статистика доставки напоминаний
+    REGISTRY.add_collector(DELIVERY_STATS.metrics)
+    await start_metrics_server()
     # Запускаем фоновую задачу проверки напоминаний
     asyncio.create_task(notification_worker())
-    
+    # Запускаем фоновую пометку просроченных задач
+    asyncio.create_task(overdue_worker())
+
+    if webhook:
+        if not settings.TELEGRAM_WEBHOOK_URL or not settings.TELEGRAM_WEBHOOK_SECRET:
+            print("❌ Для режима webhook задайте TELEGRAM_WEBHOOK_HOST и TELEGRAM_WEBHOOK_SECRET в secret.py")
+            return
+        # Регистрируем адрес сайта в Telegram; обновления будет принимать ste/asgi.py
+        await BOT.set_webhook(
+            settings.TELEGRAM_WEBHOOK_URL,
+            secret_token=settings.TELEGRAM_WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),  # только типы обновлений, для которых есть обработчики
+        )
+        print("🤖 Webhook зарегистрирован: " + settings.TELEGRAM_WEBHOOK_URL)
+        await asyncio.Event().wait()  # Event().wait() - работаем, пока процесс не остановят
+        return
+
+    # Telegram не отдаёт обновления через polling, пока зарегистрирован webhook
+    await BOT.delete_webhook()
     # Запускаем основной polling бота
     print("🤖 Запуск Telegram бота...")
     await dp.start_polling(BOT) #  запуск основного цикла работы Telegram бота, который начинает опрашивать серверы Telegram на предмет новых сообщений. В общем это Polling)
@@ -457,7 +1592,8 @@ async def main():
 # Запуск бота - точка входа в приложение
 if __name__ == "__main__":  # условие запуска при прямом выполнении файла
     try:
-        asyncio.run(main())  # запуск основной асинхронной функции
+        # --webhook - обновления принимает сайт (ste/asgi.py), а этот процесс только рассылает напоминания
+        asyncio.run(main(webhook='--webhook' in sys.argv))  # запуск основной асинхронной функции
     except KeyboardInterrupt:  # KeyboardInterrupt - исключение при нажатии Ctrl+C. Без обработки KeyboardInterrupt бот выводил бы некрасивую трассировку ошибки, кароче легче понять при окладке, не обязателен но приятное дополнение. 
         print("\n🛑 Бот остановлен")
     except Exception as e:  # обработка любых других критических ошибок. Это базовый класс для всех исключений в Python (кроме системных).
@@ -19,4 +19,28 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ste.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Импорт после get_asgi_application(): настройки Django уже загружены
+from django.conf import settings
+# bot - диспетчер и обработчики команд бота; здесь они обрабатывают обновления из webhook
+import bot
+
+
+# Общее ASGI-приложение: адрес webhook Telegram обслуживает бот, всё остальное - Django
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == settings.TELEGRAM_WEBHOOK_PATH:
+        await bot.telegram_webhook(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        # Запуск и остановка процесса сервера (Django сам lifespan не поддерживает)
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if settings.TELEGRAM_WEBHOOK_SECRET:
+                    bot.start_webhook_workers()  # сброс кэша чатов при отвязке бота на сайте
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    else:
+        await django_application(scope, receive, send)
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 
 from pathlib import Path
+# find_spec() - проверяет, установлен ли пакет, не импортируя его
+from importlib.util import find_spec
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -20,12 +22,42 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
  
-# SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = ''
-
-
+import secret
 from secret import TOKEN
 
+# SECURITY WARNING: keep the secret key used in production secret!
+# Ключ задаётся в secret.py: SECRET_KEY = 'длинная случайная строка'
+# Для тестов без ключа в secret.py - настройки ste.test_settings (python manage.py test --settings=ste.test_settings)
+SECRET_KEY = getattr(secret, 'SECRET_KEY', '')
+
+# Ключ перестановки, которой выдаются 10-значные ID профилей для /login (stem/telegram_ids.py)
+# Хранится в secret.py рядом с токеном; менять после запуска нельзя - новые ID начнут совпадать со старыми
+# Обязателен: по известному ключу любой может вычислить ID всех профилей и привязать чужой профиль к своему чату
+# Например: TELEGRAM_ID_KEY = 'длинная случайная строка' (python -c "import secrets; print(secrets.token_urlsafe(32))")
+TELEGRAM_ID_KEY = getattr(secret, 'TELEGRAM_ID_KEY', '')
+if not TELEGRAM_ID_KEY:
+    from django.core.exceptions import ImproperlyConfigured
+    raise ImproperlyConfigured("Задайте TELEGRAM_ID_KEY в secret.py - без него ID профилей для /login можно угадать")
+
+# Режим webhook (python bot.py --webhook): Telegram присылает обновления на сайт, их принимает ste/asgi.py
+# В secret.py: TELEGRAM_WEBHOOK_HOST = 'https://ваш-сайт' и TELEGRAM_WEBHOOK_SECRET = 'случайная строка'
+# Без секрета адрес webhook отвечает 404, а бот работает через polling
+TELEGRAM_WEBHOOK_PATH = '/telegram/webhook/'
+TELEGRAM_WEBHOOK_HOST = getattr(secret, 'TELEGRAM_WEBHOOK_HOST', '')
+TELEGRAM_WEBHOOK_SECRET = getattr(secret, 'TELEGRAM_WEBHOOK_SECRET', '')
+TELEGRAM_WEBHOOK_URL = TELEGRAM_WEBHOOK_HOST.rstrip('/') + TELEGRAM_WEBHOOK_PATH if TELEGRAM_WEBHOOK_HOST else ''
+
+# Напоминания одного чата, время которых отличается не больше чем на столько секунд, бот присылает одним сообщением
+# 0 - каждое напоминание отдельным сообщением
+REMINDER_DIGEST_WINDOW = getattr(secret, 'REMINDER_DIGEST_WINDOW', 60)
+
+# Метрики в формате Prometheus (stem/metrics.py): сайт отдаёт их по /metrics только с заголовком
+# Authorization: Bearer <METRICS_TOKEN>; без токена в secret.py адрес отвечает 404
+# Проверки по IP нет намеренно: за обратным прокси (nginx) REMOTE_ADDR у всех запросов 127.0.0.1
+# Процесс бота отдаёт метрики на порту BOT_METRICS_PORT (только на 127.0.0.1; 0 - не запускать)
+METRICS_TOKEN = getattr(secret, 'METRICS_TOKEN', '')
+BOT_METRICS_PORT = getattr(secret, 'BOT_METRICS_PORT', 9101)
+
 # aiogram.Bot - основной класс для создания Telegram бота из библиотеки aiogram
 # Используется для отправки сообщений пользователям через Telegram API  
 # Без этого импорта: невозможна интеграция с Telegram, не работают уведомления
@@ -49,10 +81,12 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',  # полнотекстовый поиск PostgreSQL (поиск задач)
     'stem',
 ]
 
 MIDDLEWARE = [
+    'stem.metrics.MetricsMiddleware',  # первым - чтобы замер включал и остальные middleware
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,6 +119,14 @@ WSGI_APPLICATION = 'ste.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Пул соединений psycopg 3 (pip install "psycopg[pool]"): бот и сайт берут готовое соединение
+# на время запроса вместо нового подключения; max_size не меньше DB_THREADS в bot.py
+# Пул включается, только если установлен psycopg_pool; без него (например, с psycopg2) - обычные соединения
+if find_spec('psycopg_pool'):
+    DATABASE_OPTIONS = {'pool': {'min_size': 2, 'max_size': 10}}
+else:
+    DATABASE_OPTIONS = {}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',  # Используется PostgreSQL
@@ -92,10 +134,30 @@ DATABASES = {
         'USER': 'creator',
         'HOST': 'localhost',
         'PORT': '5432',
+        'OPTIONS': DATABASE_OPTIONS,
     }
 }
 
 
+# Кэш Django: готовые ответы бота со списками задач (stem/cache.py)
+# По умолчанию - в памяти процесса; для нескольких процессов бота и сайта задайте REDIS_URL в secret.py
+# Например: REDIS_URL = 'redis://localhost:6379/0' (нужен пакет redis)
+REDIS_URL = getattr(secret, 'REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},  # MAX_ENTRIES - сколько ответов держать в памяти
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -0,0 +1,6 @@
+# Настройки для тестов: python manage.py test --settings=ste.test_settings
+# Те же, что в settings.py, но тестам (вход, сессии, страницы ошибок) ключ нужен, даже если в secret.py его нет
+from .settings import *  # noqa: F403 - все настройки проекта
+
+if not SECRET_KEY:  # SECRET_KEY пришёл из settings.py
+    SECRET_KEY = 'django-insecure-tests-only'
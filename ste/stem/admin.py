@@ -4,10 +4,16 @@ from django.contrib import admin
 # Импорт модели Task из текущего приложения  
 # Используется для регистрации модели в административном интерфейсе
 # Без этого импорта: модель Task не будет доступна в админ-панели для управления
-from .models import Task
+from .models import NotificationOutbox, Task
 
 # Регистрируем модель Task с помощью декоратора 
 @admin.register(Task)
 class TaskAdmin(admin.ModelAdmin):
     # Поля, отображаемые в списке в админке
-    list_display = ['title', 'user', 'created_at', 'completed', 'reminder_time']
\ No newline at end of file
+    list_display = ['title', 'user', 'created_at', 'completed', 'reminder_time']
+
+# Неудачные доставки напоминаний: здесь видно, почему напоминание не ушло
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ['task', 'attempts', 'dead', 'next_attempt_at', 'last_error']
+    list_filter = ['dead']
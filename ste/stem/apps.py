@@ -7,3 +7,7 @@ from django.apps import AppConfig
 class StemConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'stem'
+
+    def ready(self):
+        # Подключаем обработчики сигналов (уведомления бота об изменениях напоминаний)
+        from . import signals  # noqa: F401
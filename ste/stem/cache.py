@@ -0,0 +1,62 @@
+# Кэш готовых ответов бота со списками задач (/tasks, /tasksTime, /taskAll)
+# Ответ хранится под ключом с "версией задач" пользователя; любое изменение его задач увеличивает версию,
+# и старые ответы просто перестают находиться (удалять их не нужно - истекут сами)
+
+# time - встроенная библиотека; time_ns() - начальная версия, которая не повторит прошлые
+import time
+
+# django.core.cache - кэш Django (в памяти процесса или Redis, см. CACHES в settings.py)
+from django.core.cache import cache
+from django.conf import settings
+
+# Сколько секунд хранится готовый ответ
+TASK_REPLY_TTL = 600
+
+# Кэш в памяти процесса (locmem) не общий для сайта и бота - версии в каждом процессе свои,
+# поэтому бот увеличивает свою версию по сообщению из канала PostgreSQL (см. signals.TASKS_CHANNEL)
+LOCAL_CACHE = settings.CACHES['default']['BACKEND'].endswith('LocMemCache')
+
+
+# Ключ версии задач пользователя
+def version_key(user_id):
+    return 'stem:tasks_version:' + str(user_id)
+
+
+# Функция получения версии задач пользователя
+def get_tasks_version(user_id):
+    """Текущая версия задач пользователя (создаётся при первом обращении)"""
+    key = version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # Версия могла быть вытеснена из кэша - начинаем с текущего времени, а не с 1,
+        # чтобы не совпасть с версией ещё не истёкших старых ответов
+        cache.add(key, time.time_ns(), timeout=None)  # add() - записывает, только если ключа ещё нет
+        version = cache.get(key)
+    return version
+
+
+# Функция увеличения версии задач пользователя
+def bump_tasks_version(user_id):
+    """Делает все сохранённые ответы пользователя устаревшими"""
+    try:
+        cache.incr(version_key(user_id))  # incr() - атомарное увеличение (в Redis - одна команда INCR)
+    except ValueError:  # ValueError - версии ещё нет: ответов под ней тоже нет
+        pass
+
+
+# Функция получения ответа из кэша или его построения
+def get_cached_reply(user_id, name, build):
+    """Возвращает сохранённый ответ name пользователя или строит его функцией build() и сохраняет"""
+    key = 'stem:reply:' + str(user_id) + ':' + str(get_tasks_version(user_id)) + ':' + name
+    reply = cache.get(key)
+    if reply is None:
+        reply = build()
+        cache.set(key, reply, TASK_REPLY_TTL)
+    return reply
+
+
+# Функция сброса всех ответов в памяти процесса
+def clear_local_replies():
+    """Забывает все ответы кэша в памяти процесса (изменения задач могли быть пропущены)"""
+    if LOCAL_CACHE:
+        cache.clear()
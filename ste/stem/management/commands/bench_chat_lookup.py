@@ -0,0 +1,87 @@
+# Команда для замера поиска профиля по Telegram chat_id (как в боте на каждое сообщение)
+# Запуск: python manage.py bench_chat_lookup --profiles 1000000
+# Только для тестовой базы: команда создаёт много пользователей и временно удаляет индекс
+import random
+import statistics
+import time
+
+# BaseCommand - базовый класс management-команд Django
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+
+from stem.models import TelegramProfile
+
+# Префикс имён тестовых пользователей - по нему их можно найти и удалить
+BENCH_PREFIX = 'chatbench_'
+# Тестовые чаты начинаются с этого числа, чтобы не пересекаться с настоящими
+BENCH_CHAT_BASE = 9000000000000
+# Индекс из миграции 0014, который сравниваем
+BENCH_INDEX = 'profile_unique_chat_id'
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу тестовыми профилями и меряет поиск по chat_id с индексом и без'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', type=int, default=1000000, help='Сколько тестовых профилей создать')
+        parser.add_argument('--repeat', type=int, default=200, help='Сколько поисков выполнить для замера')
+        parser.add_argument('--skip-seed', action='store_true', help='Не создавать данные (уже созданы прошлым запуском)')
+        parser.add_argument('--cleanup', action='store_true', help='Удалить тестовых пользователей и их профили и выйти')
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            deleted = User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+            self.stdout.write('Удалено объектов: ' + str(deleted[0]))
+            return
+
+        if not options['skip_seed']:
+            self.seed(options['profiles'])
+
+        profiles = TelegramProfile.objects.filter(telegram_chat_id__gte=BENCH_CHAT_BASE).count()
+        if not profiles:
+            self.stdout.write('Нет тестовых профилей - запустите команду без --skip-seed')
+            return
+
+        # Сначала без индекса (удаляем его в транзакции и откатываем), потом с индексом
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('DROP INDEX IF EXISTS "' + BENCH_INDEX + '"')
+            self.run_lookups('БЕЗ ИНДЕКСА', profiles, options['repeat'])
+            transaction.set_rollback(True)  # set_rollback() - откатываем удаление индекса
+
+        self.run_lookups('С ИНДЕКСОМ', profiles, options['repeat'])
+
+    def seed(self, profiles_count):
+        """Создаёт тестовых пользователей и привязанные профили пачками"""
+        self.stdout.write('Создаём ' + str(profiles_count) + ' профилей...')
+        start_chat = BENCH_CHAT_BASE + TelegramProfile.objects.filter(telegram_chat_id__gte=BENCH_CHAT_BASE).count()
+        for start in range(0, profiles_count, 10000):
+            size = min(10000, profiles_count - start)
+            users = User.objects.bulk_create([
+                User(username=BENCH_PREFIX + str(random.getrandbits(64))) for _ in range(size)
+            ])
+            # bulk_create() не вызывает save(), поэтому unique_id у тестовых профилей не заполняется
+            TelegramProfile.objects.bulk_create([
+                TelegramProfile(user=user, telegram_chat_id=start_chat + start + number)
+                for number, user in enumerate(users)
+            ])
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE stem_telegramprofile')  # ANALYZE - обновляем статистику планировщика PostgreSQL
+
+    def run_lookups(self, label, profiles, repeat):
+        """Печатает план и время поиска пользователя по случайному chat_id"""
+        self.stdout.write('\n===== ' + label + ' =====')
+        # Тот же запрос, что load_user_by_chat_id в bot.py
+        sample = TelegramProfile.objects.filter(telegram_chat_id=BENCH_CHAT_BASE).values_list('user_id', 'user__username')
+        self.stdout.write(sample.explain(analyze=True))  # explain(analyze=True) - EXPLAIN ANALYZE запроса
+
+        timings = []
+        for _ in range(repeat):
+            chat_id = BENCH_CHAT_BASE + random.randrange(profiles)
+            started = time.perf_counter()
+            TelegramProfile.objects.filter(telegram_chat_id=chat_id).values_list('user_id', 'user__username').first()
+            timings.append((time.perf_counter() - started) * 1000)
+        self.stdout.write('Медиана: ' + str(round(statistics.median(timings), 3)) + ' мс, '
+                          + 'максимум: ' + str(round(max(timings), 3)) + ' мс')
@@ -0,0 +1,134 @@
+# Команда для замера горячих запросов к задачам с индексами и без них
+# Запуск: python manage.py bench_task_indexes --users 20000 --tasks-per-user 150
+# Только для тестовой базы: команда создаёт миллионы задач и временно удаляет индексы
+import random
+import statistics
+import time
+from datetime import timedelta
+
+# BaseCommand - базовый класс management-команд Django
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from stem.models import Task
+
+# Префикс имён тестовых пользователей - по нему их можно найти и удалить
+BENCH_PREFIX = 'bench_'
+# Индексы из миграции 0011, которые сравниваем
+BENCH_INDEXES = ['task_pending_reminder_idx', 'task_user_open_idx', 'task_user_completed_idx']
+# Пользователь с большим количеством задач
+POWER_USER = BENCH_PREFIX + 'power'
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу тестовыми задачами и показывает планы и время горячих запросов с индексами и без'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20000, help='Сколько тестовых пользователей создать')
+        parser.add_argument('--tasks-per-user', type=int, default=150, help='Сколько задач у каждого пользователя')
+        parser.add_argument('--power-user-tasks', type=int, default=50000, help='Сколько задач у одного "тяжёлого" пользователя')
+        parser.add_argument('--repeat', type=int, default=50, help='Сколько раз выполнять каждый запрос для замера')
+        parser.add_argument('--skip-seed', action='store_true', help='Не создавать данные (уже созданы прошлым запуском)')
+        parser.add_argument('--cleanup', action='store_true', help='Удалить тестовых пользователей и их задачи и выйти')
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            deleted = User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+            self.stdout.write('Удалено объектов: ' + str(deleted[0]))
+            return
+
+        if not options['skip_seed']:
+            self.seed(options['users'], options['tasks_per_user'], options['power_user_tasks'])
+
+        # Запросы профиля меряем на "тяжёлом" пользователе - на нём разница индексов заметнее всего
+        bench_user = User.objects.filter(username=POWER_USER).first()
+        if bench_user is None:
+            self.stdout.write('Нет тестовых пользователей - запустите команду без --skip-seed')
+            return
+
+        # Сначала без индексов (удаляем их в транзакции и откатываем), потом с индексами
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for index_name in BENCH_INDEXES:
+                    cursor.execute('DROP INDEX IF EXISTS "' + index_name + '"')
+            self.run_queries('БЕЗ ИНДЕКСОВ', bench_user, options['repeat'])
+            transaction.set_rollback(True)  # set_rollback() - откатываем удаление индексов
+
+        self.run_queries('С ИНДЕКСАМИ', bench_user, options['repeat'])
+
+    def seed(self, users_count, tasks_per_user, power_user_tasks):
+        """Создаёт тестовых пользователей и задачи пачками"""
+        self.stdout.write('Создаём ' + str(users_count * tasks_per_user + power_user_tasks) + ' задач...')
+        now = timezone.now()
+        batch = []
+
+        power_user = User.objects.create(username=POWER_USER)
+        Task.objects.bulk_create(
+            [self.make_task(power_user, now) for _ in range(power_user_tasks)],
+            batch_size=10000
+        )
+        for start in range(0, users_count, 1000):
+            users = User.objects.bulk_create([
+                User(username=BENCH_PREFIX + str(random.getrandbits(64)))
+                for _ in range(min(1000, users_count - start))
+            ])
+            for user in users:
+                for _ in range(tasks_per_user):
+                    batch.append(self.make_task(user, now))
+                    if len(batch) >= 10000:
+                        Task.objects.bulk_create(batch)
+                        batch = []
+        if batch:
+            Task.objects.bulk_create(batch)
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE stem_task')  # ANALYZE - обновляем статистику планировщика PostgreSQL
+
+    def make_task(self, user, now):
+        """Задача со случайным статусом: большинство завершено, часть напоминаний уже отправлена"""
+        roll = random.random()
+        reminder_time = None
+        if random.random() < 0.5:
+            reminder_time = now + timedelta(minutes=random.randint(-60 * 24 * 365, 60 * 24 * 30))
+        return Task(
+            user=user,
+            title='Тестовая задача',
+            reminder_time=reminder_time,
+            completed=roll < 0.7,
+            overdue=0.7 <= roll < 0.8,
+            notification_sent=reminder_time is not None and reminder_time < now - timedelta(minutes=5),
+        )
+
+    def run_queries(self, label, user, repeat):
+        """Печатает план и время каждого горячего запроса"""
+        now = timezone.now()
+        user_tasks = Task.objects.filter(user=user)
+        queries = {
+            'Захват наступивших напоминаний (bot.py)': Task.objects.filter(
+                reminder_time__lte=now, notification_sent=False, completed=False
+            ).filter(
+                Q(claimed_until__isnull=True) | Q(claimed_until__lt=now)
+            ).order_by('reminder_time').values_list('id', flat=True)[:500],
+            'Загрузка кучи планировщика (bot.py)': Task.objects.filter(
+                reminder_time__lte=now + timedelta(minutes=10), notification_sent=False, completed=False
+            ).values_list('id', 'reminder_time'),
+            'Активные задачи профиля': user_tasks.filter(completed=False, overdue=False).order_by('-created_at')[:12],
+            'Просроченные задачи профиля': user_tasks.filter(overdue=True, completed=False).order_by('-created_at')[:12],
+            'Завершённые задачи профиля': user_tasks.filter(completed=True).order_by('-created_at')[:12],
+        }
+
+        self.stdout.write('\n===== ' + label + ' =====')
+        for name, queryset in queries.items():
+            self.stdout.write('\n--- ' + name)
+            self.stdout.write(queryset.explain(analyze=True))  # explain(analyze=True) - EXPLAIN ANALYZE запроса
+
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(queryset.all())  # all() - копия запроса без кэша результатов
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write('Медиана: ' + str(round(statistics.median(timings), 2)) + ' мс, '
+                              + 'максимум: ' + str(round(max(timings), 2)) + ' мс')
@@ -0,0 +1,150 @@
+# Нагрузочный тест обработчиков бота на потоке поддельных сообщений Telegram
+# Запуск: python manage.py bot_loadtest --chats 200 --updates 5000
+# Сообщения идут в тот же Dispatcher, что и при polling, но ответы не отправляются в Telegram
+# Сравнение: сначала все запросы к базе в одном потоке (как было с sync_to_async), потом в пуле потоков бота
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# BaseCommand - базовый класс management-команд Django
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+# connection_created - сигнал о новом соединении с базой (в том числе взятом из пула)
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+from aiogram import Bot
+from aiogram.types import Chat, Message, Update
+from aiogram.types import User as TelegramUser
+
+from stem.cache import bump_tasks_version
+from stem.models import Task, TelegramProfile
+from stem.telegram_ids import allocate_unique_ids
+
+# Префикс имён тестовых пользователей - по нему их можно найти и удалить
+LOADTEST_PREFIX = 'loadtest_'
+# Тестовые чаты начинаются с этого числа, чтобы не пересекаться с настоящими
+LOADTEST_CHAT_BASE = 8000000000000
+# Команды, которые по очереди присылают тестовые чаты
+LOADTEST_COMMANDS = ['/start', '/tasks', '/tasksTime', '/taskAll']
+
+
+# Бот без сети
+class FakeBot(Bot):
+    """Вместо запросов к Telegram только считает ответы"""
+
+    def __init__(self, token):
+        super().__init__(token=token)
+        self.sent = 0
+
+    async def __call__(self, method, request_timeout=None):
+        self.sent += 1
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Прогоняет поток поддельных сообщений через обработчики бота и печатает сообщений в секунду'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chats', type=int, default=200, help='Сколько тестовых чатов (пользователей) создать')
+        parser.add_argument('--tasks-per-chat', type=int, default=30, help='Сколько задач у каждого тестового пользователя')
+        parser.add_argument('--updates', type=int, default=5000, help='Сколько сообщений отправить за один прогон')
+        parser.add_argument('--db-latency', type=float, default=0,
+                            help='Задержка каждого запроса в мс, как у базы на другом сервере (0 - без задержки)')
+        parser.add_argument('--skip-seed', action='store_true', help='Не создавать данные (уже созданы прошлым запуском)')
+        parser.add_argument('--cleanup', action='store_true', help='Удалить тестовых пользователей и их задачи и выйти')
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            deleted = User.objects.filter(username__startswith=LOADTEST_PREFIX).delete()
+            self.stdout.write('Удалено объектов: ' + str(deleted[0]))
+            return
+
+        if not options['skip_seed']:
+            self.seed(options['chats'], options['tasks_per_chat'])
+
+        chats = TelegramProfile.objects.filter(user__username__startswith=LOADTEST_PREFIX).count()
+        if not chats:
+            self.stdout.write('Нет тестовых чатов - запустите команду без --skip-seed')
+            return
+
+        if options['db_latency']:
+            # Задержка ждёт без GIL, как ожидание ответа базы по сети
+            latency = options['db_latency'] / 1000
+
+            def delay_query(execute, sql, params, many, context):
+                time.sleep(latency)
+                return execute(sql, params, many, context)
+
+            def add_delay(sender, connection, **kwargs):
+                if delay_query not in connection.execute_wrappers:
+                    connection.execute_wrappers.append(delay_query)  # execute_wrappers - обёртки всех запросов соединения
+            connection_created.connect(add_delay, weak=False)
+
+        # bot - модуль бота (bot.py рядом с manage.py); импортируем здесь, чтобы команда не зависела от него при --cleanup
+        import bot
+
+        self.stdout.write('Прогон: ' + str(options['updates']) + ' сообщений из ' + str(chats) + ' чатов')
+        default_executor = bot.DB_EXECUTOR
+        bot.DB_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+        self.run_stream(bot, '1 поток базы (как sync_to_async)', chats, options['updates'])
+        bot.DB_EXECUTOR = default_executor
+        self.run_stream(bot, str(bot.DB_THREADS) + ' потоков базы', chats, options['updates'])
+
+    def seed(self, chats_count, tasks_per_chat):
+        """Создаёт авторизованных в боте тестовых пользователей с задачами"""
+        self.stdout.write('Создаём ' + str(chats_count) + ' чатов и ' + str(chats_count * tasks_per_chat) + ' задач...')
+        first_chat = LOADTEST_CHAT_BASE + TelegramProfile.objects.filter(user__username__startswith=LOADTEST_PREFIX).count()
+        users = User.objects.bulk_create([
+            User(username=LOADTEST_PREFIX + str(first_chat + number)) for number in range(chats_count)
+        ])
+        unique_ids = allocate_unique_ids(chats_count)
+        TelegramProfile.objects.bulk_create([
+            TelegramProfile(user=user, unique_id=unique_ids[number], telegram_chat_id=first_chat + number)
+            for number, user in enumerate(users)
+        ])
+
+        now = timezone.now()
+        tasks = []
+        for user in users:
+            for number in range(tasks_per_chat):
+                tasks.append(Task(
+                    user=user,
+                    title='Задача ' + str(number),
+                    reminder_time=now if number % 2 else None,  # половина - напоминания
+                    completed=number % 5 == 0,
+                    notification_sent=True,  # чтобы бот не начал рассылать их, если он запущен
+                ))
+        Task.objects.bulk_create(tasks, batch_size=5000)
+
+    def run_stream(self, bot, label, chats, updates):
+        """Отправляет updates сообщений в Dispatcher бота сразу пачкой, как их выдаёт polling"""
+        fake_bot = FakeBot(token=bot.BOT.token)
+        bot.CHAT_USERS.clear()  # каждый прогон начинаем с пустым кэшем
+        # Кэш готовых ответов тоже сбрасываем: иначе второй прогон отвечал бы ответами первого и не ходил в базу
+        # В памяти процесса - очищаем целиком, в Redis - увеличиваем версии задач тестовых пользователей
+        bot.clear_local_replies()
+        for user_id in User.objects.filter(username__startswith=LOADTEST_PREFIX).values_list('id', flat=True):
+            bump_tasks_version(user_id)
+        now = timezone.now()
+        stream = []
+        for number in range(updates):
+            chat_id = LOADTEST_CHAT_BASE + number % chats
+            stream.append(Update(
+                update_id=number,
+                message=Message(
+                    message_id=number,
+                    date=now,
+                    chat=Chat(id=chat_id, type='private'),
+                    from_user=TelegramUser(id=chat_id, is_bot=False, first_name='Тест'),
+                    text=LOADTEST_COMMANDS[number // chats % len(LOADTEST_COMMANDS)],
+                ),
+            ))
+
+        async def feed():
+            await asyncio.gather(*[bot.dp.feed_update(fake_bot, update) for update in stream])
+
+        started = time.perf_counter()
+        asyncio.run(feed())
+        elapsed = time.perf_counter() - started
+        self.stdout.write(label + ': ' + str(round(updates / elapsed)) + ' сообщений/с'
+                          + ' (' + str(round(elapsed, 2)) + ' с, ответов: ' + str(fake_bot.sent) + ')')
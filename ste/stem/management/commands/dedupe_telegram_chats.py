@@ -0,0 +1,24 @@
+# Команда исправления профилей, привязанных к одному Telegram чату
+# Запуск: python manage.py dedupe_telegram_chats --dry-run  (только показать)
+#         python manage.py dedupe_telegram_chats            (отвязать лишние профили)
+# BaseCommand - базовый класс management-команд Django
+from django.core.management.base import BaseCommand
+
+from stem.models import dedupe_telegram_chats
+
+
+class Command(BaseCommand):
+    help = 'Оставляет каждый Telegram чат привязанным только к последнему созданному профилю'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только показать профили, которые будут отвязаны')
+
+    def handle(self, *args, **options):
+        unbound = dedupe_telegram_chats(dry_run=options['dry_run'])
+        for profile_id, chat_id in unbound:
+            self.stdout.write('Профиль ' + str(profile_id) + ': отвязан от чата ' + str(chat_id))
+
+        if options['dry_run']:
+            self.stdout.write('Будет отвязано профилей: ' + str(len(unbound)))
+        else:
+            self.stdout.write('Отвязано профилей: ' + str(len(unbound)))
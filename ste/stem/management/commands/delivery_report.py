@@ -0,0 +1,75 @@
+# Команда отчёта о доставке напоминаний ботом: задержки, попытки, очередь и ошибки
+# Запуск: python manage.py delivery_report                 (за последние 24 часа, цель - 60 секунд)
+#         python manage.py delivery_report --hours 1 --slo 30
+# Задержка доставки - notified_at - reminder_time (когда бот отметил напоминание доставленным)
+from datetime import timedelta
+
+# BaseCommand - базовый класс management-команд Django
+from django.core.management.base import BaseCommand
+from django.db import connection, models
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from stem.models import NotificationOutbox, Task
+
+# Процентили задержки и доля доставок в пределах цели одним запросом
+# percentile_cont() - процентиль по упорядоченным значениям (агрегат PostgreSQL)
+LAG_SQL = """
+SELECT count(*),
+       percentile_cont(ARRAY[0.5, 0.95, 0.99]) WITHIN GROUP (ORDER BY lag),
+       max(lag),
+       count(*) FILTER (WHERE lag <= %s),
+       avg(notification_attempts),
+       count(*) FILTER (WHERE notification_attempts > 1)
+FROM (
+    SELECT EXTRACT(EPOCH FROM notified_at - reminder_time) AS lag, notification_attempts
+    FROM {table}
+    WHERE notified_at >= %s
+) AS delivered
+"""
+
+
+class Command(BaseCommand):
+    help = 'Показывает задержки доставки напоминаний, очередь и ошибки отправки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help='За сколько последних часов считать доставки')
+        parser.add_argument('--slo', type=int, default=60, help='Цель по задержке доставки в секундах')
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(hours=options['hours'])
+        with connection.cursor() as cursor:
+            cursor.execute(LAG_SQL.format(table=Task._meta.db_table), [options['slo'], since])
+            delivered, percentiles, worst, within_slo, attempts, retried = cursor.fetchone()
+
+        self.stdout.write('Доставлено за ' + str(options['hours']) + ' ч: ' + str(delivered))
+        if delivered:
+            p50, p95, p99 = percentiles
+            self.stdout.write('Задержка p50 / p95 / p99 / max: ' + ' / '.join(
+                str(round(value, 1)) for value in (p50, p95, p99, worst)) + ' с')
+            self.stdout.write('В пределах ' + str(options['slo']) + ' с: '
+                              + str(round(100 * within_slo / delivered, 2)) + '%')
+            self.stdout.write('Попыток на напоминание в среднем: ' + str(round(attempts, 2))
+                              + ', доставлено не с первой попытки: ' + str(retried))
+
+        # Очередь: наступившие неотправленные напоминания, кроме списанных
+        backlog = Task.objects.filter(
+            reminder_time__lte=Now(), notification_sent=False, completed=False
+        ).exclude(outbox__dead=True).count()
+        waiting = NotificationOutbox.objects.filter(dead=False, task__notification_sent=False).count()
+        dead = NotificationOutbox.objects.filter(dead=True).count()
+        self.stdout.write('Наступили и не отправлены: ' + str(backlog) + ' (ждут повторной попытки: ' + str(waiting) + ')')
+        self.stdout.write('Списано без доставки: ' + str(dead))
+        self.stdout.write('Недоставленные по классам ошибок:')
+
+        # Ошибки по классам: last_error начинается с "КлассОшибки: текст"
+        # split_part() - часть строки до первого двоеточия (функция PostgreSQL)
+        error_class = models.Func(
+            models.F('last_error'), models.Value(':'), models.Value(1),
+            function='split_part', output_field=models.TextField()
+        )
+        errors = NotificationOutbox.objects.filter(task__notification_sent=False).annotate(
+            error_class=error_class
+        ).values('error_class').annotate(count=models.Count('task')).order_by('-count')
+        for row in errors:
+            self.stdout.write('  ' + row['error_class'] + ': ' + str(row['count']))
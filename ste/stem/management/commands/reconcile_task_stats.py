@@ -0,0 +1,79 @@
+# Команда сверки счётчиков задач (UserTaskStats) с самими задачами
+# Запуск: python manage.py reconcile_task_stats --dry-run  (только показать расхождения)
+#         python manage.py reconcile_task_stats            (пересчитать и исправить)
+# BaseCommand - базовый класс management-команд Django
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import models, transaction
+
+from stem.models import Task, UserTaskStats, TASK_STATS_FIELDS
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики задач всех пользователей пачками и сообщает о расхождениях'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Сколько пользователей пересчитывать за один запрос')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать расхождения, ничего не менять')
+
+    def handle(self, *args, **options):
+        checked = 0
+        drifted = 0
+        created = 0
+        last_id = 0
+        while True:
+            # Пользователи идут по возрастанию id; каждая пачка - отдельная транзакция
+            user_ids = list(
+                User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:options['batch_size']]
+            )
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+
+            with transaction.atomic():
+                # Сначала блокируем счётчики пачки, потом считаем задачи
+                # select_for_update() - пока сверяем пачку, её счётчики не меняются
+                # Изменение задачи меняет счётчики в своей транзакции: если оно закоммичено до блокировки,
+                # подсчёт ниже его уже видит; если нет - оно ждёт нашей блокировки и в подсчёт не попадает
+                # Без этого: изменение между подсчётом и блокировкой есть в счётчиках, но не в подсчёте,
+                # и сверка записала бы устаревшие числа
+                stored = {stats.user_id: stats for stats in UserTaskStats.objects.select_for_update().filter(
+                    user_id__in=user_ids).order_by('user_id')}
+
+                # Настоящие счётчики всей пачки одним запросом с GROUP BY user_id
+                actual = {user_id: dict.fromkeys(TASK_STATS_FIELDS, 0) for user_id in user_ids}
+                counts = Task.objects.filter(user_id__in=user_ids).values('user_id').annotate(
+                    total=models.Count('id'),
+                    active=models.Count('id', filter=models.Q(completed=False, overdue=False)),
+                    overdue=models.Count('id', filter=models.Q(completed=False, overdue=True)),
+                    completed=models.Count('id', filter=models.Q(completed=True)),
+                )
+                for row in counts:
+                    actual[row['user_id']] = {field: row[field] for field in TASK_STATS_FIELDS}
+
+                to_update = []
+                to_create = []
+                for user_id in user_ids:
+                    stats = stored.get(user_id)
+                    if stats is None:
+                        to_create.append(UserTaskStats(user_id=user_id, **actual[user_id]))
+                        continue
+                    stored_counts = {field: getattr(stats, field) for field in TASK_STATS_FIELDS}
+                    if stored_counts != actual[user_id]:
+                        self.stdout.write('Пользователь ' + str(user_id) + ': было ' + str(stored_counts)
+                                          + ', по задачам ' + str(actual[user_id]))
+                        for field in TASK_STATS_FIELDS:
+                            setattr(stats, field, actual[user_id][field])
+                        to_update.append(stats)
+
+                if not options['dry_run']:
+                    # bulk_update() / bulk_create() - вся пачка несколькими запросами
+                    UserTaskStats.objects.bulk_update(to_update, TASK_STATS_FIELDS, batch_size=1000)
+                    UserTaskStats.objects.bulk_create(to_create, batch_size=1000, ignore_conflicts=True)
+
+            checked += len(user_ids)
+            drifted += len(to_update)
+            created += len(to_create)
+
+        self.stdout.write('Проверено пользователей: ' + str(checked) + ', с расхождениями: ' + str(drifted)
+                          + ', без счётчиков: ' + str(created) + (' (ничего не изменено)' if options['dry_run'] else ''))
@@ -0,0 +1,26 @@
+# Команда фоновой пометки просроченных задач всех пользователей
+# Запуск один раз: python manage.py sweep_overdue
+# Запуск в цикле:  python manage.py sweep_overdue --interval 60
+import time
+
+# BaseCommand - базовый класс management-команд Django
+from django.core.management.base import BaseCommand
+
+from stem.models import sweep_overdue_tasks
+
+
+class Command(BaseCommand):
+    help = 'Помечает просроченными незавершённые напоминания всех пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Сколько задач обновлять одним запросом')
+        parser.add_argument('--interval', type=int, default=0, help='Повторять каждые N секунд (0 - выполнить один раз)')
+
+    def handle(self, *args, **options):
+        while True:
+            marked = sweep_overdue_tasks(options['chunk_size'])
+            self.stdout.write('Помечено просроченных задач: ' + str(marked))
+
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
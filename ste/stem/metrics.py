@@ -0,0 +1,158 @@
+# Метрики сайта и бота в текстовом формате Prometheus
+# Время обработки каждой страницы сайта и каждого обработчика бота, число и время их запросов к базе
+# Сайт отдаёт метрики по адресу /metrics, процесс бота - на отдельном порту (settings.BOT_METRICS_PORT)
+# Без этого: не видно, какая страница или команда бота нагружает базу
+
+# threading - блокировка: страницы сайта и запросы бота к базе выполняются в разных потоках
+import threading
+# time.perf_counter() - точные часы для замера длительности
+import time
+# ContextVar - счётчик запросов к базе текущей страницы или команды бота
+# Переходит вместе с контекстом в поток, где выполняется запрос (sync_to_async копирует контекст)
+from contextvars import ContextVar
+
+# connection_created - сигнал Django о новом соединении с базой; на нём ставим замер запросов
+from django.db.backends.signals import connection_created
+
+# Границы корзин гистограммы длительности (секунды)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+# Запросы к базе одной страницы или одной команды бота
+class QueryStats:
+    """Число запросов к базе и их суммарное время"""
+    __slots__ = ('count', 'seconds')  # __slots__ - объект создаётся на каждый запрос, лишние поля не нужны
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+# Счётчик запросов текущей страницы или команды (None - запрос к базе вне замера, например из планировщика)
+current_queries = ContextVar('current_queries', default=None)
+
+
+# Обёртка выполнения SQL (connection.execute_wrappers)
+def query_timer(execute, sql, params, many, context):
+    stats = current_queries.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.seconds += time.perf_counter() - started
+
+
+# Обработчик нового соединения с базой: ставит замер запросов
+def install_query_timer(sender, connection, **kwargs):
+    # Соединение из пула может подключаться снова - обёртку добавляем один раз
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+connection_created.connect(install_query_timer)
+
+
+# Функция экранирования значения метки
+def label_value(value):
+    """Экранирует обратную косую черту, кавычку и перевод строки"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Хранилище метрик процесса
+class Registry:
+    """Гистограммы и счётчики с одной меткой; render() отдаёт их в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # имя -> (описание, имя метки, {значение метки -> [корзины..., сумма, количество]})
+        self.counters = {}  # имя -> (описание, имя метки, {значение метки -> число})
+        self.collectors = []  # функции, которые возвращают дополнительные строки метрик (статистика доставки бота)
+
+    def observe(self, name, description, label, value, amount, buckets=DURATION_BUCKETS):
+        """Добавляет наблюдение amount в гистограмму name с меткой label=value"""
+        with self.lock:
+            series = self.histograms.setdefault(name, (description, label, {}))[2]
+            row = series.get(value)
+            if row is None:
+                row = series[value] = [0] * len(buckets) + [0.0, 0]
+            for index, bound in enumerate(buckets):
+                if amount <= bound:
+                    row[index] += 1
+            row[-2] += amount
+            row[-1] += 1
+
+    def inc(self, name, description, label, value, amount=1):
+        """Увеличивает счётчик name с меткой label=value на amount"""
+        with self.lock:
+            series = self.counters.setdefault(name, (description, label, {}))[2]
+            series[value] = series.get(value, 0) + amount
+
+    def add_collector(self, collector):
+        """Регистрирует функцию, строки которой добавляются в конец ответа"""
+        self.collectors.append(collector)
+
+    def render(self, buckets=DURATION_BUCKETS):
+        """Все метрики процесса в текстовом формате Prometheus"""
+        lines = []
+        with self.lock:
+            for name, (description, label, series) in sorted(self.histograms.items()):
+                lines.append('# HELP ' + name + ' ' + description)
+                lines.append('# TYPE ' + name + ' histogram')
+                for value, row in sorted(series.items()):
+                    labels = label + '="' + label_value(value) + '"'
+                    # Корзины накопленные: в каждой число наблюдений не больше её границы
+                    for index, bound in enumerate(buckets):
+                        lines.append(name + '_bucket{' + labels + ',le="' + str(bound) + '"} ' + str(row[index]))
+                    lines.append(name + '_bucket{' + labels + ',le="+Inf"} ' + str(row[-1]))
+                    lines.append(name + '_sum{' + labels + '} ' + str(row[-2]))
+                    lines.append(name + '_count{' + labels + '} ' + str(row[-1]))
+            for name, (description, label, series) in sorted(self.counters.items()):
+                lines.append('# HELP ' + name + ' ' + description)
+                lines.append('# TYPE ' + name + ' counter')
+                for value, count in sorted(series.items()):
+                    lines.append(name + '{' + label + '="' + label_value(value) + '"} ' + str(count))
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+# Метрики этого процесса
+REGISTRY = Registry()
+
+
+# Замер одной страницы сайта или одной команды бота
+class RequestTimer:
+    """Считает время и запросы к базе с создания до finish()"""
+
+    def __init__(self):
+        self.queries = QueryStats()
+        self.token = current_queries.set(self.queries)
+        self.started = time.perf_counter()
+
+    def finish(self, kind, label, name):  # kind - 'view' или 'bot'; label - имя метки; name - страница или обработчик
+        """Записывает замер в метрики stem_<kind>_..."""
+        seconds = time.perf_counter() - self.started
+        current_queries.reset(self.token)
+        REGISTRY.observe('stem_' + kind + '_seconds', 'Время обработки', label, name, seconds)
+        REGISTRY.inc('stem_' + kind + '_db_queries_total', 'Запросы к базе', label, name, self.queries.count)
+        REGISTRY.inc('stem_' + kind + '_db_seconds_total', 'Время запросов к базе', label, name, self.queries.seconds)
+
+
+# Middleware Django: замер каждой страницы сайта
+class MetricsMiddleware:
+    """Записывает время страницы и её запросы к базе с меткой view (имя маршрута)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = RequestTimer()
+        try:
+            return self.get_response(request)
+        finally:
+            # resolver_match - найденный маршрут; без него (404 по неизвестному адресу) метка одна на всех
+            match = getattr(request, 'resolver_match', None)
+            timer.finish('view', 'view', match.view_name if match else 'unmatched')
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:01
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY не блокирует запись в таблицу, но не работает внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('stem', '0010_task_claim_lease'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='task',
+            index=models.Index(condition=models.Q(('completed', False), ('notification_sent', False)), fields=['reminder_time'], name='task_pending_reminder_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='task',
+            index=models.Index(condition=models.Q(('completed', False)), fields=['user', 'overdue', '-created_at'], name='task_user_open_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='task',
+            index=models.Index(condition=models.Q(('completed', True)), fields=['user', '-created_at'], name='task_user_completed_idx'),
+        ),
+    ]
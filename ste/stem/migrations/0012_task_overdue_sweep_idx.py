@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:04
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY не блокирует запись в таблицу, но не работает внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('stem', '0011_task_hot_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='task',
+            index=models.Index(condition=models.Q(('completed', False), ('overdue', False)), fields=['reminder_time'], name='task_overdue_sweep_idx'),
+        ),
+    ]
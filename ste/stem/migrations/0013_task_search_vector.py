@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:08
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+# Триггер заполняет search_vector при каждой вставке и изменении названия или описания
+# Название важнее описания для ранжирования (вес A против B)
+SEARCH_TRIGGER_SQL = """
+CREATE FUNCTION stem_task_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(NEW.description, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER stem_task_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, description ON stem_task
+    FOR EACH ROW EXECUTE FUNCTION stem_task_search_vector_update();
+
+UPDATE stem_task SET search_vector =
+    setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('russian', coalesce(description, '')), 'B');
+"""
+
+DROP_SEARCH_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS stem_task_search_vector_trigger ON stem_task;
+DROP FUNCTION IF EXISTS stem_task_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY не блокирует запись в таблицу, но не работает внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('stem', '0012_task_overdue_sweep_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(SEARCH_TRIGGER_SQL, DROP_SEARCH_TRIGGER_SQL),
+        AddIndexConcurrently(
+            model_name='task',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='task_search_vector_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+# Перед созданием уникального индекса отвязываем чат от всех профилей, кроме последнего созданного
+# Та же логика, что в команде dedupe_telegram_chats (её удобно запустить заранее с --dry-run)
+DEDUPE_CHATS_SQL = """
+UPDATE stem_telegramprofile AS profile SET telegram_chat_id = NULL
+WHERE telegram_chat_id IS NOT NULL AND EXISTS (
+    SELECT 1 FROM stem_telegramprofile AS newer
+    WHERE newer.telegram_chat_id = profile.telegram_chat_id AND newer.id > profile.id
+);
+"""
+
+CREATE_INDEX_SQL = """
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS profile_unique_chat_id
+ON stem_telegramprofile (telegram_chat_id) WHERE telegram_chat_id IS NOT NULL;
+"""
+
+DROP_INDEX_SQL = "DROP INDEX CONCURRENTLY IF EXISTS profile_unique_chat_id;"
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY не блокирует запись в таблицу, но не работает внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('stem', '0013_task_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunSQL(DEDUPE_CHATS_SQL, migrations.RunSQL.noop),
+        # Для Django это обычный UniqueConstraint, а в базе индекс строится без блокировки таблицы
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(CREATE_INDEX_SQL, DROP_INDEX_SQL),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='telegramprofile',
+                    constraint=models.UniqueConstraint(condition=models.Q(('telegram_chat_id__isnull', False)), fields=('telegram_chat_id',), name='profile_unique_chat_id'),
+                ),
+            ],
+        ),
+    ]
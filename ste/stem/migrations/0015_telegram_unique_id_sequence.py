@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:05
+
+from django.db import migrations
+
+
+# Последовательность номеров для 10-значных ID профилей (stem/telegram_ids.py)
+# nextval() не откатывается вместе с транзакцией, поэтому два профиля никогда не получат один номер
+CREATE_SEQUENCE_SQL = "CREATE SEQUENCE IF NOT EXISTS stem_telegram_unique_id_seq START 1;"
+DROP_SEQUENCE_SQL = "DROP SEQUENCE IF EXISTS stem_telegram_unique_id_seq;"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stem', '0014_telegramprofile_unique_chat_id'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_SEQUENCE_SQL, DROP_SEQUENCE_SQL),
+    ]
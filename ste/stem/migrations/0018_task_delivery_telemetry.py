@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stem', '0017_notificationoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='notification_attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='notified_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -7,10 +7,25 @@ from django.db import models
 # Предоставляет готовую систему авторизации с username, password, email
 from django.contrib.auth.models import User
 
-# random - стандартная библиотека Python для генерации случайных чисел
-# Используется для создания уникальных 10-значных ID для Telegram интеграции
+# SearchVectorField - колонка tsvector PostgreSQL для полнотекстового поиска
+# GinIndex - индекс GIN, по которому PostgreSQL быстро ищет слова в tsvector
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+
+# IntegrityError - ошибка нарушения уникальности; transaction - точка сохранения при вставке профиля
+from django.db import IntegrityError, transaction
+
+# allocate_unique_ids - выдача 10-значных ID из последовательности без перебора и проверок занятости
 # Без этого импорта: не сможем генерировать уникальные коды для авторизации в боте
-import random
+from .telegram_ids import allocate_unique_ids
+
+# datetime.timedelta - класс временного интервала (задержка перед пометкой "просрочено")
+from datetime import timedelta
+# django.utils.timezone - текущее время с учётом часового пояса
+from django.utils import timezone
+
+# Напоминание считается просроченным через 2 минуты после своего времени
+OVERDUE_GRACE = timedelta(minutes=2)
 
 # Модель Task для хранения заметок и напоминаний пользователей
 class Task(models.Model):  # класс модели - наследуется от models.Model
@@ -39,10 +54,194 @@ class Task(models.Model):  # класс модели - наследуется о
     # Статус отправки уведомления (для напоминаний через Telegram бота)
     notification_sent = models.BooleanField(default=False)  # булево поле отслеживания отправленных уведомлений
     
+    # Когда бот отметил напоминание доставленным и сколько всего было попыток отправки (с успешной)
+    # notified_at - reminder_time - задержка доставки, по ней считает команда delivery_report
+    notified_at = models.DateTimeField(null=True, blank=True)
+    notification_attempts = models.IntegerField(default=0)
+    
+    # Аренда напоминания процессом бота: кто забрал напоминание на отправку и до какого времени
+    # Несколько процессов bot.py делят напоминания без повторной отправки; аренда упавшего процесса истекает
+    claimed_by = models.CharField(max_length=100, blank=True, default='')  # "хост:pid" процесса бота
+    claimed_until = models.DateTimeField(null=True, blank=True)  # после этого времени напоминание можно забрать снова
+    
+    # Поисковый вектор по названию и описанию (заполняется триггером PostgreSQL при каждом сохранении)
+    search_vector = SearchVectorField(null=True, editable=False)  # editable=False - поле не показывается в формах
+    
+    class Meta:
+        indexes = [
+            # Частичный индекс по наступившим напоминаниям: только неотправленные и незавершённые задачи
+            # Используется при захвате напоминаний ботом и загрузке кучи планировщика
+            models.Index(
+                fields=['reminder_time'],
+                name='task_pending_reminder_idx',
+                condition=models.Q(notification_sent=False, completed=False),  # condition - индекс только по этим строкам (PostgreSQL)
+            ),
+            # Частичный индекс для фоновой пометки просроченных задач (sweep_overdue_tasks)
+            models.Index(
+                fields=['reminder_time'],
+                name='task_overdue_sweep_idx',
+                condition=models.Q(completed=False, overdue=False),
+            ),
+            # Полнотекстовый поиск по задачам (search_tasks)
+            GinIndex(fields=['search_vector'], name='task_search_vector_idx'),
+            # Списки профиля: активные и просроченные задачи пользователя, новые сначала
+            models.Index(
+                fields=['user', 'overdue', '-created_at'],
+                name='task_user_open_idx',
+                condition=models.Q(completed=False),
+            ),
+            # Список профиля: завершённые задачи пользователя, новые сначала
+            models.Index(
+                fields=['user', '-created_at'],
+                name='task_user_completed_idx',
+                condition=models.Q(completed=True),
+            ),
+        ]
+
     # Строковое представление объекта (для отображения в админке и списках)
     def __str__(self):
         return self.title
 
+# Неудачные доставки напоминаний (outbox): попытки, последняя ошибка и время следующей попытки
+# Строка появляется только после первой ошибки - успешная с первого раза доставка сюда ничего не пишет
+# Без этого: бот повторял бы заведомо неотправляемые напоминания при каждой проверке
+class NotificationOutbox(models.Model):
+    # Первичный ключ - id задачи: у напоминания не больше одной строки
+    task = models.OneToOneField(Task, on_delete=models.CASCADE, primary_key=True, related_name='outbox')
+    attempts = models.IntegerField(default=0)  # сколько раз отправка не удалась
+    last_error = models.TextField(blank=True)  # текст последней ошибки (для админки)
+    next_attempt_at = models.DateTimeField()  # раньше этого времени бот напоминание не забирает
+    # dead=True - напоминание больше не отправляется (бот заблокирован, чат удалён, попытки кончились)
+    dead = models.BooleanField(default=False)
+
+    def __str__(self):
+        return "Доставка задачи " + str(self.task_id)
+
+# Счётчики задач пользователя по категориям (одна строка на пользователя)
+# Обновляются вместе с задачами в одной транзакции, поэтому профиль не пересчитывает задачи на каждый запрос
+# Расхождения (например, после bulk_create в тестовых командах) исправляет команда reconcile_task_stats
+class UserTaskStats(models.Model):
+    # Первичный ключ - id пользователя: счётчики читаются одним поиском по первичному ключу
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    total = models.IntegerField(default=0)
+    active = models.IntegerField(default=0)
+    overdue = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+
+    def __str__(self):
+        return "Счётчики задач " + str(self.user_id)
+
+# Поля счётчиков в том виде, в каком их возвращает get_task_stats
+TASK_STATS_FIELDS = ['total', 'active', 'overdue', 'completed']
+
+# Функция определения категории задачи
+def task_category(completed, overdue):
+    """Категория задачи для счётчиков: 'completed', 'overdue' или 'active'"""
+    if completed:
+        return 'completed'
+    if overdue:
+        return 'overdue'
+    return 'active'
+
+# Функция подсчёта задач пользователя по самим задачам
+def count_task_stats(user_id):
+    """Считает все счётчики задач пользователя одним запросом (условная агрегация)"""
+    # Count(..., filter=Q(...)) - превращается в COUNT(*) FILTER (WHERE ...) внутри одного SELECT
+    return Task.objects.filter(user_id=user_id).aggregate(
+        total=models.Count('id'),
+        active=models.Count('id', filter=models.Q(completed=False, overdue=False)),
+        overdue=models.Count('id', filter=models.Q(completed=False, overdue=True)),
+        completed=models.Count('id', filter=models.Q(completed=True)),
+    )
+
+# Функция пересоздания счётчиков пользователя
+def rebuild_task_stats(user_id):
+    """Пересчитывает счётчики по задачам и сохраняет их; возвращает словарь счётчиков"""
+    stats = count_task_stats(user_id)
+    UserTaskStats.objects.update_or_create(user_id=user_id, defaults=stats)  # update_or_create() - обновить или создать строку
+    return stats
+
+# Функция изменения счётчиков вместе с задачами
+# Вызывается внутри той же транзакции, что и изменение задач, уже после него
+def adjust_task_stats(user_id, **changes):  # changes - изменения счётчиков, например active=-1, completed=1
+    """Прибавляет изменения к счётчикам пользователя одним UPDATE"""
+    changes['total'] = changes.get('active', 0) + changes.get('overdue', 0) + changes.get('completed', 0)
+    # F('поле') + n - увеличение прямо в базе, без чтения строки; одновременные изменения не теряются
+    updated = UserTaskStats.objects.filter(user_id=user_id).update(
+        **{field: models.F(field) + changes.get(field, 0) for field in TASK_STATS_FIELDS}
+    )
+    if not updated:
+        # Строки счётчиков ещё нет - считаем по задачам (изменение уже в них учтено)
+        rebuild_task_stats(user_id)
+
+# Функция получения счётчиков задач пользователя
+# Используется страницей профиля
+def get_task_stats(user):
+    """Возвращает счётчики задач пользователя одним поиском по первичному ключу"""
+    user_id = getattr(user, 'pk', user)  # можно передать пользователя или его id
+    stats = UserTaskStats.objects.filter(user_id=user_id).values(*TASK_STATS_FIELDS).first()
+    if stats is None:
+        stats = rebuild_task_stats(user_id)
+    return stats
+
+# Функция пометки просроченных задач всех пользователей
+# Запускается фоново (команда sweep_overdue и бот), а не при каждом открытии профиля
+def sweep_overdue_tasks(chunk_size=1000):
+    """Помечает просроченными незавершённые напоминания всех пользователей пачками по chunk_size"""
+    overdue_time = timezone.now() - OVERDUE_GRACE
+    marked = 0
+    while True:
+        with transaction.atomic():
+            # Берём очередную пачку id по индексу task_overdue_sweep_idx
+            # select_for_update() - задачи пачки нельзя завершить или удалить, пока счётчики не обновлены
+            # skip_locked=True - задачи, которые сейчас меняет пользователь, возьмём при следующем проходе
+            rows = list(
+                Task.objects.select_for_update(skip_locked=True).filter(
+                    reminder_time__lt=overdue_time,  # время напоминания уже прошло
+                    completed=False,  # задача не завершена
+                    overdue=False  # задача еще не отмечена как просроченная
+                ).order_by('reminder_time').values_list('id', 'user_id')[:chunk_size]
+            )
+            if not rows:
+                return marked
+
+            marked += Task.objects.filter(id__in=[row[0] for row in rows]).update(overdue=True)
+
+            # Счётчики: у каждого пользователя пачки столько-то активных задач стали просроченными
+            per_user = {}
+            for task_id, user_id in rows:
+                per_user[user_id] = per_user.get(user_id, 0) + 1
+            # sorted() - строки счётчиков блокируем по возрастанию id пользователя, как и все остальные сборщики
+            # Без этого: два сборщика (бот и команда sweep_overdue) с пользователями в разном порядке ждут друг друга
+            for user_id, count in sorted(per_user.items()):
+                adjust_task_stats(user_id, active=-count, overdue=count)
+
+            # update() не вызывает сигналы - сбрасываем кэш ответов бота сами
+            # Импорт внутри функции: signals импортирует models
+            from .signals import tasks_changed
+            tasks_changed(per_user)
+
+# Функция завершения задачи пользователем (кнопка "Выполнено" на сайте)
+def complete_user_task(user_id, task_id):
+    """Отмечает задачу выполненной условным UPDATE; возвращает True, если задача была не выполнена"""
+    from .signals import notify_reminder_changed, tasks_changed
+    with transaction.atomic():
+        # Категорию задачи узнаём из самого условия UPDATE, без чтения строки:
+        # сначала пробуем активную задачу, затем просроченную
+        # Если задачу как раз помечает sweep_overdue_tasks, UPDATE дождётся его и проверит условие заново
+        for category, overdue in (('active', False), ('overdue', True)):
+            updated = Task.objects.filter(
+                id=task_id, user_id=user_id, completed=False, overdue=overdue
+            ).update(completed=True, overdue=False)  # пишем только два поля, а не всю строку
+            if updated:
+                adjust_task_stats(user_id, **{category: -1, 'completed': 1})
+                # update() не вызывает сигналы: сбрасываем кэш ответов бота и снимаем напоминание сами
+                # Для заметки без времени планировщик просто ничего не найдёт
+                tasks_changed([user_id])
+                notify_reminder_changed(task_id)
+                return True
+    return False  # задача уже выполнена или не принадлежит пользователю
+
 # Модель для связывания пользователей сайта с Telegram ботом
 class TelegramProfile(models.Model):  # класс модели профиля для Telegram интеграции
     # Связь один-к-одному с пользователем Django (у каждого пользователя один Telegram профиль)
@@ -52,6 +251,7 @@ class TelegramProfile(models.Model):  # класс модели профиля 
     unique_id = models.BigIntegerField(unique=True, null=True, blank=True)  # BigIntegerField - поле для больших чисел; unique=True - уникальное значение
     
     # Chat ID из Telegram для отправки сообщений пользователю
+    # Один чат привязан не больше чем к одному профилю (см. profile_unique_chat_id в Meta)
     telegram_chat_id = models.BigIntegerField(null=True, blank=True)  # поле для хранения ID чата Telegram
     
     # Время создания профиля (автоматически устанавливается)
@@ -59,23 +259,57 @@ class TelegramProfile(models.Model):  # класс модели профиля 
     
     def save(self, *args, **kwargs):  # метод save() - переопределение сохранения модели
         """Переопределяем метод save для автоматической генерации уникального ID"""
+        # ID уже есть - обычное сохранение
+        if self.unique_id:
+            super().save(*args, **kwargs)  # super() - вызов родительского метода
+            return
+
         # Генерируем уникальный 10-значный ID только при первом сохранении
-        if not self.unique_id:  # проверка отсутствия ID
-            # Ищем свободный уникальный ID
-            id_found = False
-            while not id_found:  # цикл до нахождения уникального ID
-                # Генерируем случайное 10-значное число
-                new_unique_id = random.randint(1000000000, 9999999999)  # random.randint() - функция генерации случайного числа
-                
-                # Проверяем, занят ли этот ID
-                id_exists = TelegramProfile.objects.filter(unique_id=new_unique_id).exists()  # exists() - метод проверки существования объекта
-                
-                if not id_exists:  # если ID свободен
-                    self.unique_id = new_unique_id  # присваиваем найденный ID
-                    id_found = True  # завершаем поиск
-                    
-        super().save(*args, **kwargs)  # super() - вызов родительского метода
+        # Номера из последовательности не повторяются, поэтому ID свободен без проверки
+        while True:
+            self.unique_id = allocate_unique_ids()[0]
+            try:
+                with transaction.atomic():  # точка сохранения: при ошибке откатывается только эта вставка
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                # Совпасть ID может только со старым случайным ID, выданным до миграции 0015 - берём следующий
+                # Любая другая ошибка (например, профиль этого пользователя уже создан) пробрасывается дальше
+                if not TelegramProfile.objects.filter(unique_id=self.unique_id).exists():
+                    self.unique_id = None
+                    raise
+
+    class Meta:
+        constraints = [
+            # Уникальный частичный индекс по chat_id: бот ищет профиль по чату на каждое сообщение,
+            # а непривязанные профили (NULL) в индекс не попадают
+            # Без этого: каждый поиск - полный просмотр таблицы, а два профиля с одним чатом ломают .get()
+            models.UniqueConstraint(
+                fields=['telegram_chat_id'],
+                name='profile_unique_chat_id',
+                condition=models.Q(telegram_chat_id__isnull=False),
+            ),
+        ]
     
     # Строковое представление объекта
     def __str__(self):
-        return "Telegram профиль " + self.user.username
\ No newline at end of file
+        return "Telegram профиль " + self.user.username
+
+# Функция исправления профилей, привязанных к одному и тому же чату
+# Нужна перед созданием profile_unique_chat_id на старых данных (команда dedupe_telegram_chats)
+def dedupe_telegram_chats(dry_run=False):
+    """Оставляет чат за последним созданным профилем и отвязывает остальные; возвращает список отвязанных"""
+    duplicates = (
+        TelegramProfile.objects.filter(telegram_chat_id__isnull=False)
+        .values('telegram_chat_id')
+        .annotate(profiles=models.Count('id'), keep_id=models.Max('id'))  # annotate() - GROUP BY telegram_chat_id
+        .filter(profiles__gt=1)
+    )
+    unbound = []
+    for row in duplicates:
+        # Профиль с наибольшим id остаётся привязанным, остальные теряют чат
+        stale = TelegramProfile.objects.filter(telegram_chat_id=row['telegram_chat_id']).exclude(id=row['keep_id'])
+        unbound += list(stale.values_list('id', 'telegram_chat_id'))
+        if not dry_run:
+            stale.update(telegram_chat_id=None)
+    return unbound
\ No newline at end of file
@@ -0,0 +1,78 @@
+# Курсорная (keyset) пагинация задач по паре (created_at, id), новые сначала
+# В отличие от OFFSET каждая страница - это диапазон по индексу, её цена не зависит от номера страницы
+# Курсор непрозрачен для пользователя: в нём закодированы направление и позиция крайней задачи страницы
+
+# base64 - встроенная библиотека для кодирования курсора в короткую строку для URL
+import base64
+# datetime - разбор времени создания задачи из курсора
+from datetime import datetime
+
+from django.db.models import Q
+
+# Сколько задач показывать на одной странице
+PAGE_SIZE = 12
+
+
+# Функция кодирования позиции задачи в непрозрачный курсор
+def encode_cursor(task, direction='next'):
+    """Превращает направление и (created_at, id) задачи в строку для URL"""
+    # direction: 'next' - задачи старше этой, 'prev' - задачи новее этой
+    raw = direction + "|" + task.created_at.isoformat() + "|" + str(task.id)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")  # "=" в конце не нужен в URL
+
+
+# Функция разбора курсора
+def decode_cursor(cursor):
+    """Возвращает (направление, created_at, id) из курсора или None, если курсор пустой или испорчен"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)  # возвращаем отброшенные "="
+        direction, created_at, task_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        if direction not in ('next', 'prev'):
+            return None
+        return direction, datetime.fromisoformat(created_at), int(task_id)
+    except ValueError:  # ValueError - курсор подделан или обрезан: показываем первую страницу
+        return None
+
+
+# Функция получения одной страницы задач
+def keyset_page(queryset, cursor=None, size=PAGE_SIZE):
+    """Возвращает (задачи страницы, курсор следующей страницы, курсор предыдущей страницы)"""
+    position = decode_cursor(cursor)
+    if position is None:
+        direction = 'next'
+    else:
+        direction, created_at, task_id = position
+
+    if direction == 'next':
+        queryset = queryset.order_by('-created_at', '-id')
+        if position:
+            # Задачи "после" курсора: раньше по времени, а при равном времени - с меньшим id
+            # created_at__lte вынесено отдельно, чтобы PostgreSQL использовал его как условие индекса
+            queryset = queryset.filter(
+                Q(created_at__lte=created_at) & (Q(created_at__lt=created_at) | Q(id__lt=task_id))
+            )
+    else:
+        # Назад идём по тому же индексу в обратном порядке, потом разворачиваем страницу
+        queryset = queryset.order_by('created_at', 'id').filter(
+            Q(created_at__gte=created_at) & (Q(created_at__gt=created_at) | Q(id__gt=task_id))
+        )
+
+    # Берём на одну задачу больше, чтобы узнать, есть ли ещё страница в этом направлении (без COUNT)
+    tasks = list(queryset[:size + 1])
+    has_more = len(tasks) > size
+    tasks = tasks[:size]
+    if direction == 'prev':
+        tasks.reverse()
+
+    next_cursor = None
+    prev_cursor = None
+    if tasks:
+        # Следующая страница есть, если дальше есть задачи или мы пришли с неё назад
+        if has_more or direction == 'prev':
+            next_cursor = encode_cursor(tasks[-1], 'next')
+        # Предыдущая страница есть, если мы пришли с неё вперёд или перед страницей есть задачи
+        if (direction == 'next' and position) or (direction == 'prev' and has_more):
+            prev_cursor = encode_cursor(tasks[0], 'prev')
+    return tasks, next_cursor, prev_cursor
@@ -0,0 +1,93 @@
+# django.db.connection - текущее соединение Django с базой данных
+# Нужно для отправки pg_notify в PostgreSQL
+from django.db import connection, transaction
+# django.db.models.signals - сигналы моделей, срабатывают после сохранения/удаления объекта
+from django.db.models.signals import post_save, post_delete
+# django.dispatch.receiver - декоратор подписки функции на сигнал
+from django.dispatch import receiver
+
+from .models import Task
+# bump_tasks_version - сбрасывает сохранённые ответы бота со списками задач пользователя
+from .cache import bump_tasks_version
+
+# Канал PostgreSQL LISTEN/NOTIFY, который слушает планировщик напоминаний в bot.py
+# Без этого: бот узнаёт о новых напоминаниях только при перезагрузке горизонта
+REMINDER_CHANNEL = 'stem_reminders'
+# Канал, в который сообщается об изменении задач пользователя (payload - id пользователей через запятую)
+# Без этого: бот с кэшем в памяти процесса отвечал бы списком задач, сохранённым до изменения
+TASKS_CHANNEL = 'stem_tasks'
+# Канал, в который сообщается об отвязке Telegram чата от профиля
+# Без этого: бот ещё до 5 минут отвечал бы отвязанному чату из своего кэша
+CHAT_CHANNEL = 'stem_chats'
+
+
+# Функция отправки в канал PostgreSQL
+def pg_notify(channel, payload):
+    """Отправляет сообщение в канал LISTEN/NOTIFY (только PostgreSQL)"""
+    # LISTEN/NOTIFY есть только в PostgreSQL
+    if connection.vendor != 'postgresql':
+        return
+
+    # pg_notify() доставляется слушателям только после фиксации транзакции
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, %s)", [channel, payload])
+
+
+# Функция отправки изменения напоминания боту
+def notify_reminder_changed(task_id, reminder_time=None):
+    """Сообщает боту новое время напоминания задачи (None - напоминание снято)"""
+    # Формат сообщения: "id:время" или "id:" если напоминание больше не нужно
+    payload = str(task_id) + ":"
+    if reminder_time is not None:
+        payload += reminder_time.isoformat()
+    pg_notify(REMINDER_CHANNEL, payload)
+
+
+# Функция сброса кэша пользователя чата в процессах бота
+def notify_chat_changed(chat_id):
+    """Сообщает боту, что привязка чата chat_id к профилю изменилась"""
+    pg_notify(CHAT_CHANNEL, str(chat_id))
+
+
+# Функция сброса кэша ответов бота после изменения задач
+def tasks_changed(user_ids):
+    """Увеличивает версию задач пользователей после фиксации транзакции и сообщает об этом боту"""
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return
+
+    def bump():
+        for user_id in user_ids:
+            bump_tasks_version(user_id)
+    # on_commit() - только после фиксации: иначе бот мог бы успеть сохранить ответ со старыми задачами под новой версией
+    transaction.on_commit(bump)
+    # Сообщение NOTIFY не длиннее 8000 байт - отправляем id пачками по 500
+    for start in range(0, len(user_ids), 500):
+        pg_notify(TASKS_CHANNEL, ",".join(str(user_id) for user_id in user_ids[start:start + 500]))
+
+
+# Обработчик любого изменения задачи: создание, редактирование, выполнение, удаление
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+def task_changed(sender, instance, **kwargs):
+    tasks_changed([instance.user_id])
+
+
+# Обработчик сохранения задачи (создание, редактирование, выполнение)
+@receiver(post_save, sender=Task)
+def task_saved(sender, instance, **kwargs):
+    # Заметки без времени планировщику не интересны
+    if instance.reminder_time is None:
+        return
+
+    if instance.completed or instance.notification_sent:
+        notify_reminder_changed(instance.id)  # снимаем напоминание
+    else:
+        notify_reminder_changed(instance.id, instance.reminder_time)
+
+
+# Обработчик удаления задачи
+@receiver(post_delete, sender=Task)
+def task_deleted(sender, instance, **kwargs):
+    if instance.reminder_time is not None:
+        notify_reminder_changed(instance.id)
@@ -11,6 +11,7 @@ class TaskManager {  // TaskManager - класс для управления и
     this.setupSearchFunctionality();
     this.setupSortAndFilterFunctionality();
     this.setupDetailButtons();
+    this.setupInfiniteScroll();
   }
 
   // Инициализация элементов DOM
@@ -50,7 +51,8 @@ class TaskManager {  // TaskManager - класс для управления и
     // Контейнеры задач
     this.containers = {
       active: document.querySelector('.tasks-grid[data-section="active"]'),
-      completed: document.querySelector('.tasks-grid[data-section="completed"]')
+      completed: document.querySelector('.tasks-grid[data-section="completed"]'),
+      overdue: document.querySelector('.tasks-grid[data-section="overdue"]')
     };
   }
 
@@ -131,87 +133,264 @@ class TaskManager {  // TaskManager - класс для управления и
   setupDetailButtons() {
     const self = this;
     document.querySelectorAll('.task-item').forEach(function(taskItem) { 
-        const actions = taskItem.querySelector('.task-actions');
-      if (actions == null) return;
+      self.addDetailButton(taskItem);
+    });
+  }
 
-      // Создаем кнопку "Подробнее"
-          const button = document.createElement('button');
-          button.type = 'button';
-          button.className = 'btn btn-toggle';
-          button.textContent = 'Подробнее';
+  // Добавление кнопки "Подробнее" в одну карточку (используется и для подгруженных задач)
+  addDetailButton(taskItem) {
+    const self = this;
+    const actions = taskItem.querySelector('.task-actions');
+    if (actions == null) return;
 
-      button.addEventListener('click', function() {
-        self.openModal(taskItem);
-          });
+    // Создаем кнопку "Подробнее"
+    const button = document.createElement('button');
+    button.type = 'button';
+    button.className = 'btn btn-toggle';
+    button.textContent = 'Подробнее';
 
-          actions.prepend(button);
-          // Кнопка добавляется в НАЧАЛО контейнера actions с помощью prepend()
+    button.addEventListener('click', function() {
+      self.openModal(taskItem);
     });
+
+    actions.prepend(button);
+    // Кнопка добавляется в НАЧАЛО контейнера actions с помощью prepend()
+  }
+
+  // === БЕСКОНЕЧНАЯ ПРОКРУТКА ===
+  // Подгрузка следующих задач раздела, когда пользователь долистал до конца списка.
+  // Адрес берётся из data-page-url, позиция - из data-next-cursor (курсор keyset-пагинации)
+  setupInfiniteScroll() {
+    const self = this;
+    if (!('IntersectionObserver' in window)) return;
+
+    document.querySelectorAll('.tasks-grid[data-page-url]').forEach(function(container) {
+      if (!container.dataset.nextCursor) return;  // всё уже показано
+
+      // Невидимый элемент после списка: когда он появляется на экране - грузим ещё
+      const sentinel = document.createElement('div');
+      sentinel.className = 'scroll-sentinel';
+      container.after(sentinel);
+
+      // IntersectionObserver - следит, виден ли элемент на экране
+      const observer = new IntersectionObserver(function(entries) {
+        if (entries[0].isIntersecting) {
+          self.loadMoreTasks(container, observer, sentinel);
+        }
+      }, { rootMargin: '200px' });  // начинаем загрузку заранее, за 200px до конца
+      observer.observe(sentinel);
+    });
+  }
+
+  // Загрузка следующей страницы задач в контейнер
+  loadMoreTasks(container, observer, sentinel) {
+    const self = this;
+    const cursor = container.dataset.nextCursor;
+    if (!cursor || container.dataset.loading == 'true' || container.dataset.searching == 'true') return;
+    container.dataset.loading = 'true';
+
+    // fetch() - асинхронный HTTP запрос к JSON эндпоинту
+    fetch(container.dataset.pageUrl + '?cursor=' + encodeURIComponent(cursor))
+      .then(function(response) {
+        if (!response.ok) throw new Error('HTTP ' + response.status);
+        return response.json();
+      })
+      .then(function(data) {
+        // Превращаем HTML из ответа в элементы и добавляем в конец списка
+        const template = document.createElement('template');
+        template.innerHTML = data.html;
+        template.content.querySelectorAll('.task-item').forEach(function(taskItem) {
+          container.appendChild(taskItem);
+          self.addDetailButton(taskItem);
+        });
+
+        container.dataset.nextCursor = data.next || '';
+        container.dataset.loading = 'false';
+        self.refreshSection(container.dataset.section);
+
+        if (!data.next) {
+          // Задачи закончились - наблюдатель больше не нужен
+          observer.disconnect();
+          sentinel.remove();
+        } else {
+          // Если конец списка всё ещё на экране - перезапуск наблюдения сразу загрузит следующую страницу
+          observer.unobserve(sentinel);
+          observer.observe(sentinel);
+        }
+      })
+      .catch(function(error) {
+        container.dataset.loading = 'false';
+        console.error('❌ Ошибка подгрузки задач:', error);
+      });
+  }
+
+  // Повторное применение сортировки и фильтра к разделу после подгрузки задач (фильтр повторяет и поиск)
+  refreshSection(section) {
+    let sortSelect = null;
+    let filterSelect = null;
+    if (section == 'active') {
+      sortSelect = this.sort.activeSelect;
+      filterSelect = this.filter.activeSelect;
+    } else if (section == 'completed') {
+      sortSelect = this.sort.completedSelect;
+      filterSelect = this.filter.completedSelect;
+    }
+
+    if (sortSelect != null) {
+      this.sortTasks(section, sortSelect.value);
+    }
+    if (filterSelect != null) {
+      this.filterTasks(section, filterSelect.value);
+    }
   }
 
 
   // === ФУНКЦИОНАЛ ПОИСКА ===
-  // Настройка поиска по названиям задач в реальном времени
+  // Поиск выполняется на сервере (полнотекстовый индекс PostgreSQL) по всем задачам раздела,
+  // а не только по карточкам, которые уже есть на странице
   setupSearchFunctionality() {
     const self = this;
+    this.searchState = {};  // состояние поиска по разделам
+
     // Поиск для активных задач
     if (this.search.activeInput) {
       this.search.activeInput.addEventListener('input', function() {
-        self.performSearch('active', self.search.activeInput.value, self.search.activeCount);
+        self.scheduleSearch('active', self.search.activeInput, self.search.activeCount);
       });
     }
     
     // Поиск для завершенных задач
     if (this.search.completedInput) {
       this.search.completedInput.addEventListener('input', function() {
-        self.performSearch('completed', self.search.completedInput.value, self.search.completedCount);
+        self.scheduleSearch('completed', self.search.completedInput, self.search.completedCount);
       });
     }
   }
 
+  // Состояние поиска раздела: таймер ввода, номер последнего запроса, исходные карточки
+  getSearchState(section) {
+    if (this.searchState[section] == null) {
+      this.searchState[section] = {
+        timer: null,
+        requestId: 0,
+        originalItems: null,
+        found: 0,
+        moreButton: null
+      };
+    }
+    return this.searchState[section];
+  }
+
+  // Запуск поиска через 300 мс после последнего нажатия клавиши (не шлём запрос на каждую букву)
+  scheduleSearch(section, input, countElement) {
+    const self = this;
+    const state = this.getSearchState(section);
+    clearTimeout(state.timer);
+    state.timer = setTimeout(function() {
+      self.performSearch(section, input, countElement, 1);
+    }, 300);
+  }
+
   // Выполнение поиска в указанной секции
   // section - секция для поиска ('active' или 'completed')
-  // query - поисковый запрос
+  // input - поле поиска (в data-search-url адрес эндпоинта)
   // countElement - элемент счетчика результатов
-//   performSearch - функция поиска, которая:
-  performSearch(section, query, countElement) {
+  // page - страница результатов (1 - новый поиск, дальше - кнопка "Показать ещё")
+  performSearch(section, input, countElement, page) {
     const container = this.containers[section];
     if (container == null) return;
 
-    const searchQuery = query.toLowerCase().trim();
-    const taskItems = container.querySelectorAll('.task-item:not(.empty-state):not(.hidden-by-filter)');
-    
-    let visibleCount = 0;
-    const totalCount = taskItems.length;
-
-    // Фильтрация задач по поисковому запросу
-    taskItems.forEach(function(taskItem) {
-      const title = taskItem.querySelector('.task-title');
-      let titleText;
-      if (title) {
-        titleText = title.textContent.toLowerCase();
-      } else {
-        titleText = '';
-      }
-      
-      let isMatch;
-      if (searchQuery == '' || titleText.includes(searchQuery)) {
-        isMatch = true;
-      } else {
-        isMatch = false;
-      }
-      
-      if (isMatch == false) {
-        taskItem.classList.add('hidden-by-search');
-      } else {
-        taskItem.classList.remove('hidden-by-search');
+    const self = this;
+    const state = this.getSearchState(section);
+    const searchQuery = input.value.trim();
+    state.requestId++;
+    const requestId = state.requestId;
+    this.removeMoreButton(state);
+
+    // Пустой запрос - возвращаем карточки, которые были до поиска
+    if (searchQuery == '') {
+      if (state.originalItems != null) {
+        container.innerHTML = '';
+        state.originalItems.forEach(function(item) {
+          container.appendChild(item);
+        });
+        state.originalItems = null;
+        container.dataset.searching = 'false';
+        this.refreshSection(section);
       }
-      
-      if (isMatch) visibleCount++;
+      this.updateResultsCount(countElement, '', 0);
+      return;
+    }
+
+    // Перед первым поиском запоминаем исходные карточки; подгрузка при прокрутке на время поиска выключена
+    if (state.originalItems == null) {
+      state.originalItems = Array.from(container.children);
+      container.dataset.searching = 'true';
+    }
+
+    const url = input.dataset.searchUrl + '?section=' + section
+      + '&q=' + encodeURIComponent(searchQuery) + '&page=' + page;
+    fetch(url)
+      .then(function(response) {
+        if (!response.ok) throw new Error('HTTP ' + response.status);
+        return response.json();
+      })
+      .then(function(data) {
+        if (requestId != state.requestId) return;  // ответ на устаревший запрос - пользователь уже ввёл другой текст
+
+        if (page == 1) {
+          container.innerHTML = '';
+          state.found = 0;
+        }
+
+        const template = document.createElement('template');
+        template.innerHTML = data.html;
+        template.content.querySelectorAll('.task-item').forEach(function(taskItem) {
+          container.appendChild(taskItem);
+          self.addDetailButton(taskItem);
+        });
+        state.found += data.count;
+
+        if (state.found == 0) {
+          const emptyState = document.createElement('li');
+          emptyState.className = 'empty-state';
+          emptyState.textContent = 'Ничего не найдено.';
+          container.appendChild(emptyState);
+        }
+
+        self.refreshSection(section);
+        self.updateResultsCount(countElement, searchQuery, state.found);
+
+        if (data.next_page) {
+          self.addMoreButton(section, input, countElement, data.next_page);
+        }
+      })
+      .catch(function(error) {
+        console.error('❌ Ошибка поиска:', error);
+      });
+  }
+
+  // Кнопка "Показать ещё" под результатами поиска
+  addMoreButton(section, input, countElement, nextPage) {
+    const self = this;
+    const state = this.getSearchState(section);
+    const button = document.createElement('button');
+    button.type = 'button';
+    button.className = 'btn search-more-btn';
+    button.textContent = 'Показать ещё';
+    button.addEventListener('click', function() {
+      self.performSearch(section, input, countElement, nextPage);
     });
+    this.containers[section].after(button);
+    state.moreButton = button;
+  }
 
-    // Обновляем счетчик результатов
-    this.updateResultsCount(countElement, searchQuery, visibleCount);
+  // Удаление кнопки "Показать ещё"
+  removeMoreButton(state) {
+    if (state.moreButton != null) {
+      state.moreButton.remove();
+      state.moreButton = null;
+    }
   }
 
 
@@ -312,24 +491,6 @@ class TaskManager {  // TaskManager - класс для управления и
         container.appendChild(emptyState);
       }
     }
-
-    // Повторяем поиск если активен
-    let searchInput;
-    let countElement;
-    if (section == 'active') {
-      searchInput = this.search.activeInput;
-      countElement = this.search.activeCount;
-    } else {
-      searchInput = this.search.completedInput;
-      countElement = this.search.completedCount;
-    }
-    
-    if (searchInput != null) {
-      if (searchInput.value.trim() != '') {
-        // Повторяем поиск напрямую
-        this.performSearch(section, searchInput.value, countElement);
-      }
-    }
   }
 
   // Получение строки даты из карточки для сравнения
@@ -386,24 +547,6 @@ class TaskManager {  // TaskManager - класс для управления и
         }
       }
     });
-
-    // Обновляем поиск если активен
-    let searchInput;
-    let countElement;
-    if (section == 'active') {
-      searchInput = this.search.activeInput;
-      countElement = this.search.activeCount;
-    } else {
-      searchInput = this.search.completedInput;
-      countElement = this.search.completedCount;
-    }
-    
-    if (searchInput != null) {
-      if (searchInput.value.trim() != '') {
-        // Повторяем поиск напрямую
-        this.performSearch(section, searchInput.value, countElement);
-      }
-    }
   }
 }
 
@@ -0,0 +1,71 @@
+# Выдача 10-значных ID профилей для авторизации в боте (/login ID)
+# Номер из последовательности PostgreSQL пропускается через перестановку с секретным ключом:
+# разные номера всегда дают разные ID, поэтому не нужны ни случайный перебор, ни проверка занятости,
+# а соседние номера дают непохожие ID, которые нельзя угадать по своему
+#
+# Перестановка - сеть Фейстеля над числами [0, 94869 * 94869) с "прогулкой по циклу":
+# если результат не попал в нужный диапазон [0, 9 * 10**9), переставляем его ещё раз
+
+# hmac, hashlib - встроенные библиотеки; HMAC-SHA256 с ключом служит раундовой функцией
+import hashlib
+import hmac
+
+from django.conf import settings
+# ImproperlyConfigured - ошибка настройки: без секретного ключа ID можно вычислить
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+
+# Последовательность PostgreSQL из миграции 0015
+SEQUENCE_NAME = 'stem_telegram_unique_id_seq'
+
+# Все 10-значные числа
+ID_MIN = 10 ** 9
+ID_COUNT = 9 * 10 ** 9
+# Половинки сети Фейстеля: 94869 * 94869 = 9000127161 - ближайший квадрат не меньше ID_COUNT
+# Поэтому прогулка по циклу почти никогда не делает больше одного шага
+HALF = 94869
+ROUNDS = 4
+
+
+# Раундовая функция сети Фейстеля
+def round_value(key, round_number, value):
+    """Псевдослучайное число в [0, HALF), зависящее от ключа, номера раунда и половинки"""
+    message = str(round_number).encode() + b':' + str(value).encode()
+    digest = hmac.new(key, message, hashlib.sha256).digest()
+    return int.from_bytes(digest[:8], 'big') % HALF
+
+
+# Функция перестановки чисел [0, ID_COUNT)
+def permute(number, key=None):
+    """Взаимно однозначно переводит номер из последовательности в номер 10-значного ID"""
+    if key is None:
+        key = settings.TELEGRAM_ID_KEY
+    if not key:
+        raise ImproperlyConfigured('Задайте TELEGRAM_ID_KEY в secret.py')
+    key = key.encode()
+    if not 0 <= number < ID_COUNT:
+        raise ValueError('Номера 10-значных ID закончились: ' + str(number))
+
+    while True:
+        left, right = divmod(number, HALF)
+        for round_number in range(ROUNDS):
+            left, right = right, (left + round_value(key, round_number, right)) % HALF
+        number = left * HALF + right
+        # Результат вне диапазона - переставляем дальше; цикл перестановки рано или поздно вернёт в диапазон
+        if number < ID_COUNT:
+            return number
+
+
+# Функция получения 10-значного ID по номеру из последовательности
+def unique_id_for(sequence_value, key=None):
+    """Номер последовательности (с 1) -> 10-значный ID"""
+    return ID_MIN + permute(sequence_value - 1, key)
+
+
+# Функция выдачи ID для нескольких профилей сразу (массовый импорт пользователей)
+def allocate_unique_ids(count=1):
+    """Берёт count номеров из последовательности одним запросом и возвращает их 10-значные ID"""
+    with connection.cursor() as cursor:
+        # generate_series() - count вызовов nextval() в одном запросе
+        cursor.execute('SELECT nextval(%s) FROM generate_series(1, %s)', [SEQUENCE_NAME, count])
+        return [unique_id_for(row[0]) for row in cursor.fetchall()]
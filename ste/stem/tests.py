@@ -1,3 +1,316 @@
-from django.test import TestCase
+import time
+from datetime import timedelta
+from unittest.mock import AsyncMock, MagicMock, patch
 
-# Create your tests here.
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import EditMessageText, SendMessage
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+import bot
+# build_all_tasks_page - синхронная часть команды /taskAll из bot.py
+from bot import build_all_tasks_page
+from .models import NotificationOutbox, Task, TelegramProfile, UserTaskStats, count_task_stats, sweep_overdue_tasks
+from .pagination import decode_cursor, encode_cursor, keyset_page
+from . import telegram_ids
+
+
+# Тесты команды /taskAll: весь список и счётчики строятся одним запросом
+class TaskAllQueryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='task_all')
+        now = timezone.now()
+        Task.objects.bulk_create([
+            Task(user=self.user, title='Заметка'),
+            Task(user=self.user, title='Напоминание', reminder_time=now),
+            Task(user=self.user, title='Просрочено', reminder_time=now, overdue=True),
+            Task(user=self.user, title='Готово', completed=True),
+        ])
+
+    def test_one_query(self):
+        with self.assertNumQueries(1):
+            text, next_cursor = build_all_tasks_page(self.user.id)
+        self.assertIsNone(next_cursor)
+        self.assertIn("Всего: 4 | Активных: 2 | Просроченных: 1 | Завершенных: 1", text)
+
+    def test_next_page_one_query(self):
+        # Столько задач не помещается в одно сообщение - следующая страница тоже строится одним запросом
+        Task.objects.bulk_create([Task(user=self.user, title='Задача ' + str(number)) for number in range(500)])
+        text, next_cursor = build_all_tasks_page(self.user.id)
+        self.assertIsNotNone(next_cursor)
+        with self.assertNumQueries(1):
+            build_all_tasks_page(self.user.id, next_cursor)
+
+    def test_no_tasks(self):
+        other = User.objects.create(username='task_all_empty')
+        with self.assertNumQueries(1):
+            text, next_cursor = build_all_tasks_page(other.id)
+        self.assertIn("У вас пока нет задач", text)
+
+
+# Тесты метрик сайта: страница профиля попадает в /metrics вместе со своими запросами к базе
+@override_settings(METRICS_TOKEN='metrics-token')
+class MetricsTests(TestCase):
+    def test_profile_in_metrics(self):
+        user = User.objects.create_user(username='metrics', password='metrics-password')
+        self.client.force_login(user)
+        self.client.get('/profile/')
+        text = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer metrics-token').content.decode()
+        self.assertIn('stem_view_seconds_count{view="stem:profile"}', text)
+        queries = [line for line in text.splitlines() if line.startswith('stem_view_db_queries_total{view="stem:profile"}')]
+        self.assertEqual(len(queries), 1)
+        self.assertGreater(int(queries[0].split()[-1]), 0)
+
+    def test_token_required(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 404)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_disabled_without_token(self):
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer ').status_code, 404)
+
+
+# Поддельный бот для тестов диспетчера: запоминает отправки и отвечает заданными ошибками
+class FakeBot:
+    def __init__(self, errors=()):
+        self.sent = []  # (время отправки, chat_id, текст)
+        self.calls = []  # время каждого вызова send_message, включая ошибки
+        self.errors = list(errors)  # ошибки для первых вызовов по очереди
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        self.calls.append(time.monotonic())
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((time.monotonic(), chat_id, text))
+
+
+# Функция записи напоминания для диспетчера; minutes - на сколько минут раньше наступило
+def reminder(task_id, chat_id, minutes=0, title='Задача', description=''):
+    now = timezone.now()
+    return bot.ReminderRecord(task_id, title, description, now, now - timedelta(minutes=minutes), 'user', chat_id)
+
+
+# Тесты диспетчера напоминаний с поддельным ботом: лимиты скорости, RetryAfter и недоступные чаты
+# Запись в базу подменена: проверяется, что и с какими аргументами диспетчер записывает
+@patch.object(bot, 'mark_notifications_sent', AsyncMock(return_value=0))
+class NotificationDispatcherTests(TestCase):
+    async def test_global_rate(self):
+        # Ведро на 10 сообщений в секунду: первые 10 уходят сразу, остальные 5 - по одному за 0.1 с
+        fake = FakeBot()
+        dispatcher = bot.NotificationDispatcher(fake, global_rate=10, chat_rate=100)
+        started = time.monotonic()
+        await dispatcher.dispatch([reminder(number, 100 + number) for number in range(15)])
+        times = sorted(sent - started for sent, chat_id, text in fake.sent)
+        self.assertEqual(len(times), 15)
+        self.assertLess(times[9], 0.1)
+        self.assertGreaterEqual(times[14], 0.45)
+        self.assertEqual(dispatcher.sent, 15)
+
+    async def test_chat_rate(self):
+        # 5 сообщений в секунду на чат; напоминания одного чата с разницей 2 минуты - отдельные сообщения
+        fake = FakeBot()
+        dispatcher = bot.NotificationDispatcher(fake, concurrency=1, global_rate=100, chat_rate=5)
+        started = time.monotonic()
+        await dispatcher.dispatch([reminder(number, 1, minutes=2 * number) for number in range(4)] + [reminder(10, 2)])
+        busy = [sent - started for sent, chat_id, text in fake.sent if chat_id == 1]
+        other = [sent - started for sent, chat_id, text in fake.sent if chat_id == 2]
+        self.assertEqual(len(busy), 4)
+        for previous, current in zip(busy, busy[1:]):
+            self.assertGreaterEqual(current - previous, 0.18)
+        # Очередь занятого чата ждёт вне семафора - другой чат не стоит за ней даже при одном месте отправки
+        self.assertLess(other[0], 0.1)
+
+    async def test_retry_after_debt(self):
+        # RetryAfter на 1 с: ведро уходит в долг, повтор - не раньше чем через секунду
+        fake = FakeBot(errors=[TelegramRetryAfter(SendMessage(chat_id=1, text=''), 'Flood control', 1)])
+        dispatcher = bot.NotificationDispatcher(fake, global_rate=100, chat_rate=100)
+        await dispatcher.dispatch([reminder(1, 1)])
+        self.assertEqual(len(fake.calls), 2)
+        self.assertGreaterEqual(fake.calls[1] - fake.calls[0], 0.9)
+        self.assertEqual((dispatcher.sent, dispatcher.failed, dispatcher.retries), (1, 0, 1))
+
+    async def test_forbidden_dead_letter_and_unlink(self):
+        # Бот заблокирован: все напоминания дайджеста списываются, чат отвязывается
+        fake = FakeBot(errors=[TelegramForbiddenError(SendMessage(chat_id=7, text=''), 'bot was blocked by the user')])
+        dispatcher = bot.NotificationDispatcher(fake)
+        with patch.object(bot, 'record_notification_failure', AsyncMock()) as failure, \
+                patch.object(bot, 'disconnect_user', AsyncMock()) as disconnect:
+            await dispatcher.dispatch([reminder(1, 7), reminder(2, 7)])
+        self.assertEqual(sorted(call.args[0] for call in failure.await_args_list), [1, 2])
+        self.assertTrue(all(call.args[2] for call in failure.await_args_list))  # permanent=True
+        disconnect.assert_awaited_once_with(7)
+        self.assertEqual((dispatcher.sent, dispatcher.failed), (0, 2))
+
+
+# Тесты записи недоставляемого напоминания в базу: списание в outbox и отвязка чата
+class ChatGoneTests(TestCase):
+    def test_dead_letter_and_unlink(self):
+        user = User.objects.create(username='chat_gone')
+        TelegramProfile.objects.create(user=user, telegram_chat_id=7)
+        task = Task.objects.create(user=user, title='Напоминание', reminder_time=timezone.now())
+        # __wrapped__ - синхронная функция под db_async: выполняем её в транзакции теста
+        bot.record_notification_failure.__wrapped__(task.id, 'TelegramForbiddenError: blocked', True)
+        self.assertTrue(NotificationOutbox.objects.get(task=task).dead)
+        self.assertEqual(bot.clear_chat_binding.__wrapped__(7).id, user.id)
+        self.assertIsNone(TelegramProfile.objects.get(user=user).telegram_chat_id)
+
+
+# Тесты дайджеста: сообщения не длиннее лимита Telegram, каждое напоминание ровно в одном сообщении
+class DigestTests(TestCase):
+    def test_split_by_limit(self):
+        tasks = [reminder(number, 1, title='Задача & ' * 20 + str(number), description='Описание ' * 40)
+                 for number in range(100)]
+        messages = bot.build_reminder_messages(tasks)
+        self.assertGreater(len(messages), 1)
+        for message in messages:
+            self.assertLessEqual(bot.telegram_length(message.text), bot.MESSAGE_LIMIT)
+        included = [task.id for message in messages for task in message.tasks]
+        self.assertEqual(sorted(included), list(range(100)))
+
+    def test_task_text_escaped(self):
+        message = bot.build_reminder_messages([reminder(1, 1, title='config_file <b>', description='a & b')])[0]
+        self.assertIn('config_file &lt;b&gt;', message.text)
+        self.assertIn('a &amp; b', message.text)
+
+
+# Тесты курсорной пагинации: порядок (created_at, id), задачи с одинаковым временем и границы страниц
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='keyset')
+        now = timezone.now()
+        # По времени создания группы из 2, 3 и 2 задач; группа из трёх попадает на стык первой и второй страницы
+        minutes = [0, 0, 1, 1, 1, 2, 2]
+        self.tasks = [Task.objects.create(user=self.user, title='Задача ' + str(number)) for number in range(7)]
+        for task, minute in zip(self.tasks, minutes):
+            Task.objects.filter(id=task.id).update(created_at=now - timedelta(minutes=minute))
+        self.order = list(Task.objects.filter(user=self.user).order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def page(self, cursor=None):
+        tasks, next_cursor, prev_cursor = keyset_page(Task.objects.filter(user=self.user), cursor, size=3)
+        return [task.id for task in tasks], next_cursor, prev_cursor
+
+    def test_cursor_round_trip(self):
+        task = Task.objects.get(id=self.tasks[3].id)
+        self.assertEqual(decode_cursor(encode_cursor(task, 'prev')), ('prev', task.created_at, task.id))
+        self.assertIsNone(decode_cursor('не-курсор'))
+        self.assertIsNone(decode_cursor(''))
+
+    def test_forward_and_back(self):
+        first, next_cursor, prev_cursor = self.page()
+        self.assertEqual(first, self.order[:3])
+        self.assertIsNone(prev_cursor)  # первая страница - назад некуда
+        second, next_cursor, prev_cursor = self.page(next_cursor)
+        self.assertEqual(second, self.order[3:6])
+        third, last_next, third_prev = self.page(next_cursor)
+        self.assertEqual(third, self.order[6:])
+        self.assertIsNone(last_next)  # последняя страница - дальше некуда
+        # Назад с последней страницы - снова вторая, с неё - первая
+        back, next_cursor, prev_cursor = self.page(third_prev)
+        self.assertEqual(back, second)
+        self.assertIsNotNone(next_cursor)
+        back, next_cursor, prev_cursor = self.page(prev_cursor)
+        self.assertEqual(back, first)
+        self.assertIsNone(prev_cursor)
+        self.assertIsNotNone(next_cursor)
+
+
+# Тесты выдачи 10-значных ID: перестановка взаимно однозначна, ID из последовательности не повторяются
+class TelegramIdTests(TestCase):
+    def test_permutation_bijective(self):
+        # Весь диапазон 9 * 10**9 не перебрать - проверяем ту же сеть на маленьких половинках (10 * 10 = 100 > 90),
+        # где нужна и прогулка по циклу
+        with patch.object(telegram_ids, 'HALF', 10), patch.object(telegram_ids, 'ID_COUNT', 90):
+            values = [telegram_ids.permute(number, 'key') for number in range(90)]
+        self.assertEqual(sorted(values), list(range(90)))
+
+    def test_range_and_key(self):
+        values = {telegram_ids.unique_id_for(number, 'key') for number in range(1, 2001)}
+        self.assertEqual(len(values), 2000)
+        self.assertTrue(all(10 ** 9 <= value < 10 ** 10 for value in values))
+        # Другой ключ - другие ID
+        self.assertNotEqual(telegram_ids.unique_id_for(1, 'key'), telegram_ids.unique_id_for(1, 'other'))
+        with self.assertRaises(ValueError):
+            telegram_ids.permute(telegram_ids.ID_COUNT, 'key')
+
+    @override_settings(TELEGRAM_ID_KEY='')
+    def test_key_required(self):
+        with self.assertRaises(ImproperlyConfigured):
+            telegram_ids.permute(0)
+
+    def test_allocate_without_collisions(self):
+        first = telegram_ids.allocate_unique_ids(500)
+        second = telegram_ids.allocate_unique_ids(500)
+        self.assertEqual(len(set(first + second)), 1000)
+        self.assertTrue(all(len(str(value)) == 10 for value in first + second))
+
+
+# Тесты счётчиков задач: после добавления, пометки просроченных, завершения и удаления
+# сохранённые счётчики совпадают с подсчётом по самим задачам
+class TaskStatsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='stats', password='stats-password')
+        self.client.force_login(self.user)
+
+    def assertStats(self, **expected):
+        stored = UserTaskStats.objects.filter(user=self.user).values('total', 'active', 'overdue', 'completed').get()
+        self.assertEqual(stored, count_task_stats(self.user.id))
+        self.assertEqual(stored, dict(stored, **expected))
+
+    def test_bookkeeping(self):
+        for number in range(3):
+            self.client.post('/', {'title': 'Заметка ' + str(number), 'description': ''})
+        self.assertStats(total=3, active=3)
+
+        # Время напоминания двух задач давно прошло - сборщик помечает их просроченными
+        late, other, note = Task.objects.filter(user=self.user).order_by('id')
+        Task.objects.filter(id__in=[late.id, other.id]).update(reminder_time=timezone.now() - timedelta(hours=1))
+        self.assertEqual(sweep_overdue_tasks(), 2)
+        self.assertStats(active=1, overdue=2)
+
+        self.client.post('/complete/' + str(late.id) + '/')
+        self.client.post('/complete/' + str(late.id) + '/')  # повторное нажатие счётчики не трогает
+        self.client.post('/complete/' + str(note.id) + '/')
+        self.assertStats(total=3, active=0, overdue=1, completed=2)
+
+        self.client.post('/delete/' + str(other.id) + '/')
+        self.client.post('/delete/' + str(late.id) + '/')
+        self.assertStats(total=1, active=0, overdue=0, completed=1)
+
+
+# Тесты курсора страницы из данных кнопки: подделанный курсор заменяется первой страницей
+class TasksCursorTests(TestCase):
+    def test_valid(self):
+        self.assertEqual(bot.valid_tasks_cursor('notes', '123'), '123')
+        self.assertEqual(bot.valid_tasks_cursor('reminders', '7'), '7')
+        self.assertEqual(bot.valid_tasks_cursor('all', '2.15'), '2.15')
+
+    def test_forged(self):
+        for kind, cursor in (('notes', 'abc'), ('notes', '-1'), ('notes', '1.2'), ('notes', '9' * 30),
+                             ('all', '1'), ('all', '3.5'), ('all', '1.x'), ('all', '1.2.3'), ('reminders', '')):
+            self.assertIsNone(bot.valid_tasks_cursor(kind, cursor), kind + ':' + cursor)
+
+
+# Тесты кнопок листания: на подделанные данные и ошибки Telegram обработчик всё равно отвечает на нажатие
+@patch.object(bot, 'get_user_by_chat_id', AsyncMock(return_value=None))
+class TasksPageHandlerTests(TestCase):
+    def callback(self, data, error=None):
+        callback = MagicMock()
+        callback.data = data
+        callback.answer = AsyncMock()
+        callback.message.edit_text = AsyncMock(side_effect=error)
+        return callback
+
+    async def test_forged_data(self):
+        for data in ('tasks:notes:abc', 'tasks:all:9.x', 'tasks:notes', 'tasks:unknown:1'):
+            callback = self.callback(data)
+            await bot.tasks_page_handler(callback)
+            callback.answer.assert_awaited_once()
+
+    async def test_not_modified(self):
+        error = TelegramBadRequest(EditMessageText(text=''), 'Bad Request: message is not modified')
+        callback = self.callback('tasks:notes:', error)
+        await bot.tasks_page_handler(callback)
+        callback.message.edit_text.assert_awaited_once()
+        callback.answer.assert_awaited_once()
@@ -32,5 +32,11 @@ urlpatterns = [
     path('complete/<int:task_id>/', views.complete_task, name='complete_task'),
     # URL для отключения Telegram бота
     path('disconnect-telegram/', views.disconnect_telegram, name='disconnect_telegram'),
+    # JSON со следующей страницей задач раздела профиля (active, overdue, completed)
+    path('tasks/<str:section>/', views.tasks_page, name='tasks_page'),
+    # JSON с результатами полнотекстового поиска задач
+    path('search/', views.search_tasks, name='search_tasks'),
+    # Метрики для Prometheus (время страниц и запросы к базе); работают, только если задан METRICS_TOKEN
+    path('metrics', views.metrics, name='metrics'),
 
 ]
\ No newline at end of file
@@ -1,5 +1,3 @@
-# django.utils.timezone - модуль для работы с временными зонами в Django
-from django.utils import timezone
 # render - рендерит HTML шаблоны с контекстом
 # redirect - перенаправляет на другие URL
 # get_object_or_404 - получает объект из БД или возвращает 404 ошибку
@@ -20,18 +18,36 @@ from django.contrib.auth.decorators import login_required
 # ReminderForm - форма создания напоминаний с временем
 from .forms import NoteForm, ReminderForm
 # TelegramProfile - модель связи пользователей с Telegram
-from .models import Task, TelegramProfile
+# get_task_stats - счётчики задач пользователя по категориям (одна строка UserTaskStats)
+# adjust_task_stats, task_category - изменение счётчиков вместе с задачами
+# complete_user_task - завершение задачи одним условным UPDATE
+from .models import Task, TelegramProfile, adjust_task_stats, complete_user_task, get_task_stats, task_category
+# transaction - задача и её счётчики меняются в одной транзакции
+from django.db import transaction
 # django.views.decorators.http.require_POST - декоратор ограничения HTTP методов
 # Разрешает доступ к view только через POST запросы
 # Без этого: небезопасные операции могут выполняться через GET запросы
 from django.views.decorators.http import require_POST
-# django.core.paginator.Paginator - класс для разбивки данных на страницы
-# Позволяет отображать большие списки задач частями
-from django.core.paginator import Paginator
-# datetime.timedelta - класс для работы с временными интервалами
-# Используется для определения просроченных задач (сравнение с текущим временем)
-# Без этого импорта: не работает логика определения просроченных напоминаний  
-from datetime import timedelta 
+# django.http - JsonResponse для ответа скрипту подгрузки, Http404 для неизвестного раздела
+from django.http import Http404, HttpResponse, JsonResponse
+# render_to_string - рендерит шаблон в строку (HTML карточек для JSON-ответа)
+from django.template.loader import render_to_string
+# re - регулярные выражения; выделяем слова из поискового запроса
+import re
+# SearchQuery - поисковый запрос PostgreSQL (tsquery), SearchRank - релевантность результата
+from django.contrib.postgres.search import SearchQuery, SearchRank
+# F - ссылка на колонку таблицы в выражениях запроса
+from django.db.models import F
+# keyset_page - курсорная пагинация задач по (created_at, id)
+# Позволяет отображать большие списки задач частями, каждая страница стоит одинаково
+from .pagination import keyset_page
+# notify_chat_changed - сообщает боту об отвязке чата, чтобы он сбросил его из кэша
+from .signals import notify_chat_changed
+# REGISTRY - метрики процесса (время страниц и команд бота, запросы к базе)
+from .metrics import REGISTRY
+# settings - токен доступа к метрикам; hmac.compare_digest() сверяет его за постоянное время
+from django.conf import settings
+import hmac
 
 
 # Страница добавления заметки
@@ -43,7 +59,9 @@ def add_note(request):  # view-функция для добавления зам
         if form.is_valid():  # is_valid() - метод валидации формы
             task = form.save(commit=False)  # save(commit=False) - создание объекта без сохранения в БД
             task.user = request.user  # request.user - объект текущего пользователя
-            task.save()  # сохранение задачи в базу данных
+            with transaction.atomic():  # задача и счётчики сохраняются вместе
+                task.save()  # сохранение задачи в базу данных
+                adjust_task_stats(request.user.id, active=1)
             return redirect('stem:profile')  # redirect() - функция перенаправления на другую страницу
         else:
             messages.error(request, 'Ошибка в форме.')  # messages.error() - функция показа сообщения об ошибке
@@ -61,7 +79,9 @@ def add_reminder(request):  # view-функция для добавления н
         if form.is_valid():
             task = form.save(commit=False)  # создание объекта задачи без сохранения
             task.user = request.user  # привязка к текущему пользователю
-            task.save()  # сохранение в базу данных
+            with transaction.atomic():
+                task.save()  # сохранение в базу данных
+                adjust_task_stats(request.user.id, active=1)
             return redirect('stem:profile')  # перенаправление на страницу профиля
         else:
             messages.error(request, 'Ошибка в форме.')  # показ ошибки валидации
@@ -70,60 +90,115 @@ def add_reminder(request):  # view-функция для добавления н
     # Рендерим шаблон с формой
     return render(request, 'stem/add_reminder.html', {'form': form})
 
-# Функция проверки и маркировки просроченных задач
-def check_overdue_tasks(user):  # функция проверки просроченных задач
-    overdue_time = timezone.now() - timedelta(minutes=2)  # timedelta - класс временного интервала; minutes=2 - интервал в 2 минуты
-    
-    # Находим задачи которые нужно отметить как просроченные
-    overdue_tasks = Task.objects.filter(user=user)  # сначала берем задачи пользователя
-    overdue_tasks = overdue_tasks.filter(reminder_time__lt=overdue_time)  # время напоминания уже прошло
-    overdue_tasks = overdue_tasks.filter(reminder_time__isnull=False)  # у задачи есть время напоминания
-    overdue_tasks = overdue_tasks.filter(completed=False)  # задача не завершена
-    overdue_tasks = overdue_tasks.filter(overdue=False)  # задача еще не отмечена как просроченная
-    
-    # Отмечаем найденные задачи как просроченные
-    overdue_tasks.update(overdue=True)  # update() - метод массового обновления записей в БД
+# Разделы профиля и условия отбора задач для каждого из них
+TASK_SECTIONS = {
+    'active': {'completed': False, 'overdue': False},
+    'overdue': {'completed': False, 'overdue': True},
+    'completed': {'completed': True},
+}
+
+# Функция получения задач пользователя для раздела профиля
+def get_section_tasks(user, section):
+    """Возвращает queryset задач пользователя из раздела section"""
+    # defer('search_vector') - tsvector нужен только условию поиска, а не карточкам задач; без него строки шире
+    return Task.objects.filter(user=user, **TASK_SECTIONS[section]).defer('search_vector')  # **словарь - распаковка условий фильтра
+
+# Сколько результатов поиска отдавать за один запрос
+SEARCH_PAGE_SIZE = 12
+
+# Функция построения поискового запроса из текста пользователя
+def build_search_query(text):
+    """Превращает текст в запрос "все слова по префиксу" или None, если слов нет"""
+    # Оставляем только буквы и цифры - так в tsquery не попадут служебные символы
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    # "слово:*" - поиск по началу слова, чтобы результаты были видны уже во время набора
+    raw_query = " & ".join(word + ":*" for word in words)
+    return SearchQuery(raw_query, config='russian', search_type='raw')
 
 # Страница профиля
 @login_required
 def profile(request):  # view-функция страницы профиля пользователя
-    check_overdue_tasks(request.user)  # проверка и обновление просроченных задач
+    # Просроченные задачи помечает фоновая команда sweep_overdue - страница только читает данные
     
     # Создаём Telegram профиль если его нет
     TelegramProfile.objects.get_or_create(user=request.user)  # get_or_create() - метод получения или создания объекта
     
-    # Оптимизированные запросы
-    user_tasks = Task.objects.filter(user=request.user)  # получение всех задач пользователя
-    active_tasks = user_tasks.filter(completed=False, overdue=False).order_by('-created_at')  # фильтрация активных задач; order_by() - сортировка по дате создания
-    
-    # Пагинация активных задач
-    paginator = Paginator(active_tasks, 12)  # разбиваем задачи по 12 на страницу
-    page_number = request.GET.get('page', 1)  # получаем номер страницы из URL
-    active_page = paginator.get_page(page_number)  # получаем задачи для текущей страницы
-
-    # Подготавливаем данные для шаблона
-    completed_tasks = user_tasks.filter(completed=True).order_by('-created_at')
-    overdue_tasks = user_tasks.filter(overdue=True, completed=False).order_by('-created_at')
+    # Пагинация активных задач по курсору из URL (?cursor=...) - по 12 на страницу
+    active_tasks, active_next, active_prev = keyset_page(
+        get_section_tasks(request.user, 'active'),
+        request.GET.get('cursor')  # получаем курсор страницы из URL
+    )
+
+    # Завершённые и просроченные задачи - только первая страница, остальное подгружает script.js
+    completed_tasks, completed_next, _ = keyset_page(get_section_tasks(request.user, 'completed'))
+    overdue_tasks, overdue_next, _ = keyset_page(get_section_tasks(request.user, 'overdue'))
     
-    # Считаем количество задач разных типов
-    active_count = active_tasks.count()
-    completed_count = completed_tasks.count()
-    overdue_count = overdue_tasks.count()
-    total_tasks = user_tasks.count()
+    # Считаем количество задач разных типов (один запрос вместо четырёх)
+    stats = get_task_stats(request.user)
     
     # Передаем все данные в шаблон
     context = {
-        'active_page': active_page,
+        'active_tasks': active_tasks,
+        'active_next': active_next,
+        'active_prev': active_prev,
         'completed_tasks': completed_tasks,
+        'completed_next': completed_next,
         'overdue_tasks': overdue_tasks,
-        'active_count': active_count,
-        'completed_count': completed_count,
-        'overdue_count': overdue_count,
-        'total_tasks': total_tasks,
+        'overdue_next': overdue_next,
+        'active_count': stats['active'],
+        'completed_count': stats['completed'],
+        'overdue_count': stats['overdue'],
+        'total_tasks': stats['total'],
     }
     
     return render(request, 'stem/profile.html', context)
 
+# Следующая страница задач раздела профиля в формате JSON (бесконечная прокрутка)
+@login_required
+def tasks_page(request, section):
+    """Отдаёт HTML карточек следующей страницы раздела и курсор для продолжения"""
+    if section not in TASK_SECTIONS:
+        raise Http404("Неизвестный раздел")
+
+    tasks, next_cursor, prev_cursor = keyset_page(get_section_tasks(request.user, section), request.GET.get('cursor'))
+    # Карточки рендерятся тем же шаблоном, что и на странице профиля
+    html = render_to_string('stem/task_items.html', {'tasks': tasks, 'section': section}, request=request)
+    return JsonResponse({'html': html, 'count': len(tasks), 'next': next_cursor, 'prev': prev_cursor})
+
+# Поиск по названию и описанию задач раздела профиля (JSON)
+@login_required
+def search_tasks(request):
+    """Отдаёт найденные задачи раздела, отсортированные по релевантности, по страницам"""
+    section = request.GET.get('section', 'active')
+    if section not in TASK_SECTIONS:
+        raise Http404("Неизвестный раздел")
+
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+
+    query = build_search_query(request.GET.get('q', ''))
+    if query is None:
+        return JsonResponse({'html': '', 'count': 0, 'next_page': None})
+
+    # search_vector=query - условие "tsvector @@ tsquery", выполняется по GIN индексу
+    offset = (page - 1) * SEARCH_PAGE_SIZE
+    found = get_section_tasks(request.user, section).filter(search_vector=query).annotate(
+        rank=SearchRank(F('search_vector'), query)
+    ).order_by('-rank', '-created_at', '-id')
+    tasks = list(found[offset:offset + SEARCH_PAGE_SIZE + 1])  # +1 - есть ли следующая страница
+
+    next_page = None
+    if len(tasks) > SEARCH_PAGE_SIZE:
+        tasks = tasks[:SEARCH_PAGE_SIZE]
+        next_page = page + 1
+
+    html = render_to_string('stem/task_items.html', {'tasks': tasks, 'section': section}, request=request)
+    return JsonResponse({'html': html, 'count': len(tasks), 'next_page': next_page})
+
 # Страница входа
 def login_view(request):  # view-функция страницы входа
     # Если пользователь отправил форму (POST)
@@ -183,18 +258,21 @@ def logout_view(request):
 @require_POST  # декоратор разрешающий только POST запросы
 def delete_task(request, task_id):  # view-функция удаления задачи; task_id - параметр ID задачи из URL
     # Находим задачу и удаляем её
-    task = get_object_or_404(Task, id=task_id, user=request.user)  # get_object_or_404() - функция получения объекта или ошибки 404
-    task.delete()  # удаляем задачу
+    with transaction.atomic():
+        # select_for_update() - задачу не изменит фоновая пометка просроченных, пока мы её удаляем
+        task = get_object_or_404(Task.objects.select_for_update(), id=task_id, user=request.user)  # get_object_or_404() - функция получения объекта или ошибки 404
+        task.delete()  # удаляем задачу
+        adjust_task_stats(request.user.id, **{task_category(task.completed, task.overdue): -1})
     return redirect('stem:profile')  # перенаправление обратно на профиль
 
 @login_required
 @require_POST
 def complete_task(request, task_id):
-    task = get_object_or_404(Task, id=task_id, user=request.user)
-    # Отмечаем задачу как выполненную
-    task.completed = True
-    task.overdue = False
-    task.save()
+    # Отмечаем задачу как выполненной; повторное нажатие ничего не меняет (и не трогает счётчики)
+    if not complete_user_task(request.user.id, task_id):
+        # Задача уже выполнена - или её нет: отличаем только в этом редком случае
+        if not Task.objects.filter(id=task_id, user=request.user).exists():
+            raise Http404
     return redirect('stem:profile')
 
 # Функция для отключения Telegram бота от профиля пользователя
@@ -203,15 +281,17 @@ def complete_task(request, task_id):
 def disconnect_telegram(request):
     """Отвязывает Telegram бота от профиля пользователя через веб-интерфейс"""
     try:
-        # Получаем или создаем Telegram профиль пользователя
-        result = TelegramProfile.objects.get_or_create(user=request.user)
-        profile = result[0]  # первый элемент - сам объект
-        created = result[1]  # второй элемент - был ли создан новый объект
-        
-        if profile.telegram_chat_id:
-            # Если бот был подключен - отключаем его
-            profile.telegram_chat_id = None
-            profile.save()
+        # Текущий чат профиля (None - профиля нет или бот не подключен)
+        chat_id = TelegramProfile.objects.filter(user=request.user).values_list('telegram_chat_id', flat=True).first()
+        # Условный UPDATE одного поля: строка меняется, только если к профилю всё ещё привязан этот чат
+        # Без условия: одновременный /login из бота мог бы быть затёрт этим отключением
+        updated = chat_id is not None and TelegramProfile.objects.filter(
+            user=request.user, telegram_chat_id=chat_id
+        ).update(telegram_chat_id=None)
+
+        if updated:
+            # Если бот был подключен - он отключен
+            notify_chat_changed(chat_id)  # бот сбрасывает этот чат из кэша пользователей
             messages.success(request, 'Telegram бот успешно отключен от вашего профиля.')
         else:
             # Если бот уже не подключен
@@ -220,4 +300,14 @@ def disconnect_telegram(request):
         # В случае ошибки
         messages.error(request, 'Произошла ошибка при отключении бота.')
     
-    return redirect('stem:profile')
\ No newline at end of file
+    return redirect('stem:profile')
+
+# Функция выдачи метрик для Prometheus
+def metrics(request):
+    """Отдаёт метрики процесса в текстовом формате Prometheus (только с токеном METRICS_TOKEN)"""
+    # Без токена в настройках метрики выключены; чужой или пустой токен - та же 404, адрес не выдаём
+    token = settings.METRICS_TOKEN
+    provided = request.META.get('HTTP_AUTHORIZATION', '')
+    if not token or not hmac.compare_digest(provided.encode(), ('Bearer ' + token).encode()):
+        raise Http404
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')